@@ -0,0 +1,150 @@
+"""Deterministic local stand-ins for OpenAI and Composio.
+
+Latencies are drawn from a log-normal distribution around a configured mean,
+so runs see realistic tails while staying reproducible for a given seed.
+"""
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Tools the fake model calls; never the ones that send or draft email
+READ_ONLY_TOOLS = [
+    "GMAIL_GET_PROFILE",
+    "GMAIL_SEARCH_PEOPLE",
+    "COMPOSIO_SEARCH_SEARCH",
+    "COMPOSIO_SEARCH_EXA_ANSWER",
+]
+
+
+@dataclass
+class FakeConfig:
+    model_latency_ms: float = 800.0
+    model_latency_sigma: float = 0.5
+    output_tokens: int = 150
+    tool_rounds: int = 2  # model turns that call tools before the final answer
+    tool_fan_out: int = 3  # tool calls per tool-calling turn
+    tool_latency_ms: float = 400.0
+    tool_latency_sigma: float = 0.6
+    tool_result_bytes: int = 4000
+    tool_fetch_latency_ms: float = 300.0
+    seed: int = 0
+
+
+class LatencySampler:
+    """Thread-safe seeded log-normal sampler with a given mean"""
+
+    def __init__(self, seed: int):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def seconds(self, mean_ms: float, sigma: float) -> float:
+        if mean_ms <= 0:
+            return 0.0
+        mu = math.log(mean_ms) - sigma ** 2 / 2
+        with self._lock:
+            return self._random.lognormvariate(mu, sigma) / 1000
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that calls tools for a fixed number of rounds, then answers"""
+
+    config: FakeConfig
+    sampler: Any
+    calls: int = 0
+    seen_prefixes: set = set()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        self.calls += 1
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        # Mimic provider prompt caching: a system prompt seen before is a cache hit
+        cached_tokens = 0
+        if messages and messages[0].type == "system":
+            prefix = str(messages[0].content)
+            if prefix in self.seen_prefixes:
+                cached_tokens = len(prefix) // 4
+            self.seen_prefixes.add(prefix)
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": self.config.output_tokens,
+            "total_tokens": input_tokens + self.config.output_tokens,
+            "input_token_details": {"cache_read": cached_tokens},
+        }
+
+        names = [tool["function"]["name"] for tool in tools or []]
+        available = [name for name in READ_ONLY_TOOLS if name in names]
+        rounds_done = sum(1 for message in messages if getattr(message, "tool_calls", None))
+        if available and rounds_done < self.config.tool_rounds:
+            tool_calls = [
+                {
+                    "name": available[(rounds_done * self.config.tool_fan_out + i) % len(available)],
+                    "args": {"query": f"round {rounds_done} call {i}"},
+                    "id": f"call_{self.calls}_{i}",
+                }
+                for i in range(self.config.tool_fan_out)
+            ]
+            return AIMessage(content="", tool_calls=tool_calls, usage_metadata=usage)
+
+        content = " ".join(["word"] * self.config.output_tokens)
+        return AIMessage(content=content, usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.sampler.seconds(self.config.model_latency_ms, self.config.model_latency_sigma))
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.sampler.seconds(self.config.model_latency_ms, self.config.model_latency_sigma))
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+
+class _FakeTools:
+    def __init__(self, config: FakeConfig, sampler: LatencySampler):
+        self.config = config
+        self.sampler = sampler
+        self.executions = 0
+
+    def _make_tool(self, name: str, user_id: str) -> StructuredTool:
+        def execute(query: str = "") -> str:
+            """Fake Composio tool"""
+            self.executions += 1
+            time.sleep(self.sampler.seconds(self.config.tool_latency_ms, self.config.tool_latency_sigma))
+            padding = "x" * max(0, self.config.tool_result_bytes - 100)
+            return json.dumps({"successful": True, "data": {"tool": name, "user": user_id, "query": query, "text": padding}})
+
+        return StructuredTool.from_function(execute, name=name, description=f"Fake {name}")
+
+    def get(self, user_id: str, tools: Optional[List[str]] = None, toolkits: Optional[List[str]] = None):
+        """Blocking, like the real SDK; the server calls it through its executor"""
+        time.sleep(self.sampler.seconds(self.config.tool_fetch_latency_ms, 0.3))
+        return [self._make_tool(name, user_id) for name in tools or READ_ONLY_TOOLS]
+
+
+class FakeComposio:
+    """The subset of the Composio client the message pipeline uses"""
+
+    def __init__(self, config: FakeConfig, sampler: LatencySampler):
+        self.tools = _FakeTools(config, sampler)
+
+
+def make_fakes(config: FakeConfig):
+    """Build a fake model and Composio client sharing one seeded sampler"""
+    sampler = LatencySampler(config.seed)
+    return FakeChatModel(config=config, sampler=sampler), FakeComposio(config, sampler)
@@ -0,0 +1,249 @@
+"""Offline load test for the API and message processor.
+
+Replaces the OpenAI and Composio clients with the fakes in ``benchmarks.fakes``,
+drives ``POST /messages`` at a fixed arrival rate through an in-process ASGI
+transport, polls ``/messages/{id}/response`` until each message finishes and
+reports throughput, latency percentiles and memory growth.
+
+    cd poke-backend
+    python -m benchmarks.load --rate 20 --duration 30 --json results.json
+
+``--max-p95-ms`` and ``--min-throughput`` turn the run into a regression gate
+(non-zero exit when missed).
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import List, Optional
+
+from .fakes import FakeConfig, make_fakes
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def rss_mb() -> float:
+    """Current resident set size (peak on platforms without /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def configure_environment(args) -> None:
+    """Point the server at throwaway state before it is imported"""
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("COMPOSIO_API_KEY", "benchmark")
+    os.environ["POKE_STORAGE"] = args.backend
+    os.environ["POKE_QUEUE_BACKEND"] = args.backend
+    if args.backend == "sqlite":
+        os.environ["POKE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="poke-bench-"), "poke.db")
+    os.environ["POKE_NUM_WORKERS"] = str(args.workers)
+    # The fakes have no provider limits; keep client-side limits out of the way
+    # unless the run sets them explicitly
+    for name in ("POKE_OPENAI_RPM", "POKE_OPENAI_TPM", "POKE_COMPOSIO_RPM"):
+        os.environ.setdefault(name, "1000000000")
+
+
+def install_fakes(config: FakeConfig):
+    """Replace the shared OpenAI and Composio clients with the fakes"""
+    from server.constants import override_clients
+
+    model, composio = make_fakes(config)
+    override_clients(openai=model, composio=composio)
+    return model, composio
+
+
+async def run_message(client, user_id: str, content: str, poll_interval: float, timeout: float, results: dict):
+    started = time.perf_counter()
+    response = await client.post("/messages", json={"user_id": user_id, "content": content})
+    results["submit_ms"].append((time.perf_counter() - started) * 1000)
+    if response.status_code == 429:
+        results["rejected"] += 1
+        return
+    if response.status_code != 200:
+        results["errors"] += 1
+        return
+
+    message_id = response.json()["message_id"]
+    while time.perf_counter() - started < timeout:
+        await asyncio.sleep(poll_interval)
+        status = (await client.get(f"/messages/{message_id}/response")).json().get("status")
+        if status == "completed":
+            results["latency_ms"].append((time.perf_counter() - started) * 1000)
+            results["completed_at"] = time.perf_counter()
+            return
+        if status == "error":
+            results["errors"] += 1
+            return
+    results["timeouts"] += 1
+
+
+async def run_benchmark(args) -> dict:
+    configure_environment(args)
+    config = FakeConfig(
+        model_latency_ms=args.model_latency_ms,
+        output_tokens=args.output_tokens,
+        tool_rounds=args.tool_rounds,
+        tool_fan_out=args.fan_out,
+        tool_latency_ms=args.tool_latency_ms,
+        tool_result_bytes=args.tool_result_bytes,
+        seed=args.seed,
+    )
+    model, composio = install_fakes(config)
+
+    import httpx
+    from server import api
+
+    results = {"submit_ms": [], "latency_ms": [], "rejected": 0, "errors": 0, "timeouts": 0, "completed_at": None}
+    total = int(args.rate * args.duration)
+
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            user_ids = []
+            for i in range(args.users):
+                response = await client.post("/users", json={"connection_id": f"bench-{i}", "name": f"User {i}"})
+                user_ids.append(response.json()["user_id"])
+
+            if args.trace_memory:
+                tracemalloc.start()
+            rss_before = rss_mb()
+
+            research_every = round(1 / args.research_ratio) if args.research_ratio else 0
+            started = time.perf_counter()
+            tasks = []
+            for i in range(total):
+                # Open-loop arrivals: a slow server does not slow the offered load
+                delay = started + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                is_research = research_every and i % research_every == 0
+                content = "Hello Poke" if is_research else f"Message {i}: what have you found?"
+                tasks.append(asyncio.create_task(
+                    run_message(client, user_ids[i % len(user_ids)], content, args.poll_interval, args.timeout, results)
+                ))
+            await asyncio.gather(*tasks)
+
+            rss_after = rss_mb()
+            traced = tracemalloc.get_traced_memory() if args.trace_memory else None
+            if args.trace_memory:
+                tracemalloc.stop()
+            stats = (await client.get("/processor/stats")).json()
+
+    elapsed = (results["completed_at"] or time.perf_counter()) - started
+    completed = len(results["latency_ms"])
+    latency = results["latency_ms"]
+    return {
+        "config": {**vars(args), "fakes": dataclasses.asdict(config)},
+        "sent": total,
+        "completed": completed,
+        "rejected": results["rejected"],
+        "errors": results["errors"],
+        "timeouts": results["timeouts"],
+        "throughput_per_second": completed / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(latency, 50),
+            "p95": percentile(latency, 95),
+            "p99": percentile(latency, 99),
+            "max": max(latency) if latency else None,
+        },
+        "submit_ms": {
+            "p50": percentile(results["submit_ms"], 50),
+            "p99": percentile(results["submit_ms"], 99),
+        },
+        "memory_mb": {
+            "rss_before": rss_before,
+            "rss_after": rss_after,
+            "rss_growth": rss_after - rss_before,
+            "traced_current": traced[0] / 2 ** 20 if traced else None,
+            "traced_peak": traced[1] / 2 ** 20 if traced else None,
+        },
+        "model_calls": model.calls,
+        "tool_executions": composio.tools.executions,
+        "token_usage": stats["token_usage"],
+        "queue": stats["queue"],
+    }
+
+
+def format_report(report: dict) -> str:
+    def ms(value):
+        return f"{value:.0f}ms" if value is not None else "-"
+
+    latency = report["latency_ms"]
+    memory = report["memory_mb"]
+    usage = report["token_usage"]
+    lines = [
+        f"sent {report['sent']}  completed {report['completed']}  rejected {report['rejected']}  "
+        f"errors {report['errors']}  timeouts {report['timeouts']}",
+        f"throughput {report['throughput_per_second']:.2f} msg/s  "
+        f"({report['model_calls']} model calls, {report['tool_executions']} tool calls)",
+        f"latency p50 {ms(latency['p50'])}  p95 {ms(latency['p95'])}  p99 {ms(latency['p99'])}  max {ms(latency['max'])}",
+        f"submit p50 {ms(report['submit_ms']['p50'])}  p99 {ms(report['submit_ms']['p99'])}",
+        f"tokens prompt {usage['prompt_tokens']}  completion {usage['completion_tokens']}  "
+        f"cached {usage['cached_tokens']} ({usage['cache_hit_ratio']:.0%} of prompt)",
+        f"rss {memory['rss_before']:.1f}MB -> {memory['rss_after']:.1f}MB ({memory['rss_growth']:+.1f}MB)",
+    ]
+    if memory["traced_peak"] is not None:
+        lines.append(f"traced current {memory['traced_current']:.1f}MB  peak {memory['traced_peak']:.1f}MB")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline load test with fake OpenAI and Composio")
+    parser.add_argument("--rate", type=float, default=10.0, help="Messages per second offered")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of offered load")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users messages are spread over")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("POKE_NUM_WORKERS", "4")))
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite", help="Queue and storage backend")
+    parser.add_argument("--research-ratio", type=float, default=0.1, help="Share of messages that trigger research")
+    parser.add_argument("--model-latency-ms", type=float, default=800.0)
+    parser.add_argument("--output-tokens", type=int, default=150)
+    parser.add_argument("--tool-rounds", type=int, default=2)
+    parser.add_argument("--fan-out", type=int, default=3, help="Tool calls per tool-calling model turn")
+    parser.add_argument("--tool-latency-ms", type=float, default=400.0)
+    parser.add_argument("--tool-result-bytes", type=int, default=4000)
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Give up on a message after this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="Also measure Python allocations (slower)")
+    parser.add_argument("--json", help="Write the full report to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail if p95 latency is above this")
+    parser.add_argument("--min-throughput", type=float, help="Fail if throughput (msg/s) is below this")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(args))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    p95 = report["latency_ms"]["p95"]
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 latency {p95}ms above {args.max_p95_ms}ms")
+    if args.min_throughput is not None and report["throughput_per_second"] < args.min_throughput:
+        failures.append(f"throughput {report['throughput_per_second']:.2f} msg/s below {args.min_throughput}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
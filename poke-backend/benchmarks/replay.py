@@ -0,0 +1,252 @@
+"""Replay a recorded cassette offline.
+
+Record real traffic by starting the server with ``POKE_RECORD_CASSETTE`` set to
+a file path; every ``PokeAgent.process_message`` call is appended to it with
+its model responses, tool results and their timings. This script feeds the
+recorded messages back through ``PokeAgent`` at their original arrival
+offsets, with OpenAI and Composio replaced by the recording, and compares
+recorded and replayed latency.
+
+    cd poke-backend
+    python -m benchmarks.replay poke.cassette --time-scale 1.0
+    python -m benchmarks.replay poke.cassette --time-scale 0.1   # 10x faster
+
+A time scale of 1 reproduces the original model and tool latencies; 0 removes
+them and measures only our own overhead.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import StructuredTool
+
+from .load import percentile
+
+# Recorded session the current agent run replays
+replay_session: contextvars.ContextVar[Optional["ReplaySession"]] = contextvars.ContextVar("replay_session", default=None)
+
+
+class ReplayMismatch(Exception):
+    """The replayed run asked for a call the recording does not have"""
+
+
+class ReplayedToolError(Exception):
+    """A tool call that failed when it was recorded"""
+
+
+class ReplaySession:
+    """Hands out one session's recorded model and tool events"""
+
+    def __init__(self, session: dict, time_scale: float):
+        self.session = session
+        self.time_scale = time_scale
+        self._models = [event for event in session["events"] if event["kind"] == "model"]
+        self._tools = [event for event in session["events"] if event["kind"] == "tool"]
+        self._lock = threading.Lock()
+        self.mismatches = 0
+
+    def next_model(self) -> dict:
+        with self._lock:
+            if not self._models:
+                self.mismatches += 1
+                raise ReplayMismatch("No recorded model response left for this message")
+            return self._models.pop(0)
+
+    def take_tool(self, name: str, args: dict) -> dict:
+        """The recorded call with the same arguments, else the next one of the same tool"""
+        with self._lock:
+            for matches in (
+                lambda event: event["name"] == name and event["args"] == args,
+                lambda event: event["name"] == name,
+            ):
+                for i, event in enumerate(self._tools):
+                    if matches(event):
+                        return self._tools.pop(i)
+            self.mismatches += 1
+            raise ReplayMismatch(f"No recorded {name} call left for this message")
+
+    def delay(self, event: dict) -> float:
+        return event["duration"] * self.time_scale
+
+
+def _current_session() -> ReplaySession:
+    session = replay_session.get()
+    if session is None:
+        raise ReplayMismatch("Replay clients used outside a replayed message")
+    return session
+
+
+class ReplayChatModel(BaseChatModel):
+    """Answers with the recorded model responses of the current session, in order"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-replay"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        session = _current_session()
+        event = session.next_model()
+        time.sleep(session.delay(event))
+        return ChatResult(generations=[ChatGeneration(message=messages_from_dict([event["response"]])[0])])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        session = _current_session()
+        event = session.next_model()
+        await asyncio.sleep(session.delay(event))
+        return ChatResult(generations=[ChatGeneration(message=messages_from_dict([event["response"]])[0])])
+
+
+class _ReplayTools:
+    def __init__(self, sessions: List[dict], time_scale: float):
+        self.time_scale = time_scale
+        # Tool definitions are cached by the server, so a user's definitions
+        # may only have been fetched while recording one of their messages
+        self._fetches: Dict[str, dict] = {}
+        for session in sessions:
+            for event in session["events"]:
+                if event["kind"] == "tool_fetch":
+                    self._fetches.setdefault(session["user_id"], event)
+
+    def get(self, user_id: str, tools: Optional[List[str]] = None, toolkits: Optional[List[str]] = None):
+        fetch = self._fetches.get(user_id) or next(iter(self._fetches.values()), None)
+        if fetch is None:
+            raise ReplayMismatch("The cassette has no recorded tool definitions")
+        time.sleep(fetch["duration"] * self.time_scale)
+        return [self._make_tool(schema["function"]) for schema in fetch["tools"]]
+
+    def _make_tool(self, function: dict) -> StructuredTool:
+        name = function["name"]
+
+        def execute(**kwargs):
+            session = _current_session()
+            event = session.take_tool(name, kwargs)
+            time.sleep(session.delay(event))
+            if "error" in event:
+                raise ReplayedToolError(event["error"])
+            return event["result"]
+
+        return StructuredTool(
+            name=name,
+            description=function.get("description", ""),
+            args_schema=function.get("parameters", {"type": "object", "properties": {}}),
+            func=execute,
+        )
+
+
+class ReplayComposio:
+    """The subset of the Composio client the agent uses, served from a cassette"""
+
+    def __init__(self, sessions: List[dict], time_scale: float):
+        self.tools = _ReplayTools(sessions, time_scale)
+
+
+async def replay(sessions: List[dict], time_scale: float) -> dict:
+    from server.constants import override_clients
+
+    override_clients(openai=ReplayChatModel(), composio=ReplayComposio(sessions, time_scale))
+    from server.agent import PokeAgent
+
+    agent = PokeAgent()
+    results = []
+
+    async def run(session: dict):
+        replayed = ReplaySession(session, time_scale)
+        replay_session.set(replayed)
+        started = time.perf_counter()
+        error = None
+        try:
+            await agent.process_message(session["user_id"], session["message"])
+        except Exception as e:
+            error = type(e).__name__
+        results.append({
+            "user_id": session["user_id"],
+            "message": session["message"][:80],
+            "recorded_ms": session["duration"] * 1000,
+            "replayed_ms": (time.perf_counter() - started) * 1000,
+            "mismatches": replayed.mismatches,
+            "error": error,
+        })
+
+    first_offset = sessions[0]["offset"] if sessions else 0.0
+    started = time.perf_counter()
+    tasks = []
+    for session in sessions:
+        delay = started + (session["offset"] - first_offset) * time_scale - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run(session)))
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+
+    recorded = [result["recorded_ms"] for result in results]
+    replayed = [result["replayed_ms"] for result in results]
+    return {
+        "sessions": len(results),
+        "time_scale": time_scale,
+        "wall_seconds": wall,
+        "mismatched_sessions": sum(1 for result in results if result["mismatches"]),
+        "errors": sum(1 for result in results if result["error"]),
+        "recorded_ms": {pct: percentile(recorded, pct) for pct in (50, 95, 99)},
+        "replayed_ms": {pct: percentile(replayed, pct) for pct in (50, 95, 99)},
+        "results": results,
+    }
+
+
+def format_report(report: dict, slowest: int) -> str:
+    def ms(value):
+        return f"{value:.0f}ms" if value is not None else "-"
+
+    lines = [
+        f"replayed {report['sessions']} messages in {report['wall_seconds']:.1f}s (time scale {report['time_scale']})  "
+        f"mismatched {report['mismatched_sessions']}  errors {report['errors']}",
+    ]
+    for label in ("recorded_ms", "replayed_ms"):
+        values = report[label]
+        lines.append(f"{label[:-3]:>8}  p50 {ms(values[50])}  p95 {ms(values[95])}  p99 {ms(values[99])}")
+    for result in sorted(report["results"], key=lambda result: -result["replayed_ms"])[:slowest]:
+        lines.append(
+            f"  {ms(result['replayed_ms']):>8} (recorded {ms(result['recorded_ms'])})  "
+            f"{result['user_id']}: {result['message']!r}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded cassette without OpenAI or Composio")
+    parser.add_argument("cassette", help="Cassette written with POKE_RECORD_CASSETTE")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier for recorded latencies and arrival gaps")
+    parser.add_argument("--slowest", type=int, default=5, help="List this many of the slowest replayed messages")
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    os.environ.setdefault("COMPOSIO_API_KEY", "replay")
+    os.environ.pop("POKE_RECORD_CASSETTE", None)
+    for name in ("POKE_OPENAI_RPM", "POKE_OPENAI_TPM", "POKE_COMPOSIO_RPM"):
+        os.environ.setdefault(name, "1000000000")
+
+    from server.cassette import load_cassette
+
+    report = asyncio.run(replay(load_cassette(args.cassette), args.time_scale))
+    print(format_report(report, args.slowest))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+from dotenv import load_dotenv
+
+# Load .env before any server module is imported: rate limiters, the Composio
+# executor, tool caches, the compactor and the cassette recorder read their
+# settings from the environment when their modules are imported
+load_dotenv()
@@ -1,204 +1,437 @@
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, MessagesState, START, END
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, message_to_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.graph import StateGraph, MessagesState, START
 from langgraph.prebuilt import ToolNode, tools_condition
 
-from .constants import composio, openai
+from .cassette import is_recording, record_event, recording
+from .compaction import compactor
+from .constants import get_composio, get_openai
+from .executor import composio_executor
+from .metrics import ERRORS, GRAPH_BUILD_SECONDS, LLM_CALL_SECONDS, TOOL_FETCH_SECONDS
+from .model_router import ModelRouter
+from .prompts import (
+    CONVERSATION_SYSTEM_PROMPT,
+    RESEARCH_EXTRACTION_PROMPT,
+    RESEARCH_SYSTEM_PROMPT,
+    is_research_trigger,
+)
+from .rate_limit import RateLimitTimeout, estimate_tokens, openai_limiter
+from .research import (
+    ResearchProfiles,
+    collect_sources,
+    format_profile,
+    parse_findings,
+    profile_email,
+    research_runs,
+)
+from .tracing import current_trace, span
+from .usage import TokenUsage, record_usage, run_usage, total_usage
+
+logger = logging.getLogger(__name__)
+
+# System prompts are sent first and never change, so together with the tool
+# schemas they form a byte-stable prefix the provider's prompt cache can reuse
+SYSTEM_MESSAGES = {
+    "research": SystemMessage(content=RESEARCH_SYSTEM_PROMPT),
+    "conversation": SystemMessage(content=CONVERSATION_SYSTEM_PROMPT),
+}
+
+
+def tools_fingerprint(tools) -> str:
+    """Stable hash of the tool schemas, independent of the user they are bound to"""
+    schemas = sorted(
+        (convert_to_openai_tool(tool) for tool in tools),
+        key=lambda schema: schema["function"]["name"],
+    )
+    return hashlib.sha256(json.dumps(schemas, sort_keys=True).encode()).hexdigest()
 
 
 class PokeAgent:
-    def __init__(self):
-        self.model = openai
-        self.composio = composio
+    def __init__(
+        self,
+        graph_cache_size: Optional[int] = None,
+        profiles: Optional[ResearchProfiles] = None,
+        router: Optional[ModelRouter] = None,
+    ):
+        # Shared clients are resolved on first use unless set explicitly
+        self._model = None
+        self._composio = None
+        # Stored research results; research always runs from scratch without them
+        self.profiles = profiles
+        # Picks the model for each mode and falls back when one is slow or failing
+        self.router = router or ModelRouter()
+        # Compiled graphs keyed by tool-schema fingerprint, and bound models
+        # keyed by (model name, fingerprint)
+        self.graph_cache_size = graph_cache_size or int(os.getenv("POKE_GRAPH_CACHE_SIZE", "32"))
+        self._graph_cache: OrderedDict = OrderedDict()
+        self._bound_models: dict = {}
+        self.graph_cache_hits = 0
+        self.graph_cache_misses = 0
+    
+    @property
+    def model(self):
+        """The explicitly set model, otherwise the conversation model"""
+        # The routed default is never stored in _model, which holds only an override
+        return self._model if self._model is not None else self._chat_model(self.router.models["conversation"])
+    
+    @model.setter
+    def model(self, model):
+        # An explicitly set model is used for every mode
+        self._model = model
+    
+    def _chat_model(self, model_name: str):
+        return self._model if self._model is not None else get_openai(model_name)
+    
+    def warm_up_models(self) -> None:
+        """Build the clients for every model the router can pick"""
+        for model_name in {*self.router.models.values(), self.router.fallback} - {None}:
+            self._chat_model(model_name)
+    
+    @property
+    def composio(self):
+        if self._composio is None:
+            self._composio = get_composio()
+        return self._composio
+    
+    @composio.setter
+    def composio(self, composio):
+        self._composio = composio
+    
+    def _get_graph(self, tools):
+        """Get the compiled graph for this tool set, building it on first use"""
+        fingerprint = tools_fingerprint(tools)
+        
+        graph = self._graph_cache.get(fingerprint)
+        if graph is not None:
+            self._graph_cache.move_to_end(fingerprint)
+            self.graph_cache_hits += 1
+            return graph
+        
+        self.graph_cache_misses += 1
+        with GRAPH_BUILD_SECONDS.time():
+            # Tool schemas are part of the cached prompt prefix; bind them in a stable order
+            tools = sorted(tools, key=lambda tool: tool.name)
+            # Bind the default model up front so the first run does not pay for it
+            self._get_bound_model(self.router.models["conversation"], fingerprint, tools)
+            graph = self._build_graph(fingerprint, tools)
+        self._graph_cache[fingerprint] = graph
+        if len(self._graph_cache) > self.graph_cache_size:
+            evicted, _ = self._graph_cache.popitem(last=False)
+            for key in [key for key in self._bound_models if key[1] == evicted]:
+                del self._bound_models[key]
+        return graph
+    
+    def _get_bound_model(self, model_name: str, fingerprint: str, tools):
+        """Get ``model_name`` bound to a tool set, binding it on first use"""
+        key = (model_name, fingerprint)
+        model = self._bound_models.get(key)
+        if model is None:
+            model = self._bound_models[key] = self._chat_model(model_name).bind_tools(tools)
+        return model
+    
+    def _build_graph(self, fingerprint: str, tools):
+        """Build the agent/tools graph for a tool set; the model is picked per call"""
+        
+        # Build simple graph with Poke personality
+        async def call_model_with_system(state, config):
+            # Research or conversation mode is decided once per run by process_message
+            mode = config["configurable"].get("mode", "conversation")
+            messages = [SYSTEM_MESSAGES[mode]] + state["messages"]
+            with span("node", "agent"):
+                response = await self._invoke_routed(
+                    lambda model_name: self._get_bound_model(model_name, fingerprint, tools),
+                    messages,
+                    mode,
+                )
+                return {"messages": [response]}
+        
+        # Tool objects are bound to a user, so the graph is shared and the
+        # per-run ToolNode is supplied through the run config
+        async def call_tools(state, config):
+            tool_node = config["configurable"]["tool_node"]
+            with span("node", "tools", tool_calls=len(state["messages"][-1].tool_calls)):
+                result = await tool_node.ainvoke(state, config)
+            # Shrink raw tool JSON before every later model call re-sends it
+            seen = config["configurable"].get("seen_results")
+            if isinstance(result, dict) and seen is not None:
+                result = {**result, "messages": compactor.compact_messages(result["messages"], seen)}
+            return result
+        
+        workflow = StateGraph(MessagesState)
+        workflow.add_node("agent", call_model_with_system)
+        workflow.add_node("tools", call_tools)
+        workflow.add_edge(START, "agent")
+        workflow.add_conditional_edges("agent", tools_condition)
+        workflow.add_edge("tools", "agent")
+        
+        return workflow.compile()
+    
+    async def _invoke_routed(self, get_model: Callable, messages, mode: str):
+        """Call the model the router picks for this mode, retrying once on the fallback if it fails"""
+        model_name = self.router.choose(mode)
+        try:
+            return await self._invoke_model(get_model(model_name), messages, mode, model_name)
+        except RateLimitTimeout:
+            # The message's time budget is spent; another model will not help
+            raise
+        except Exception as e:
+            fallback = self.router.fallback_for(model_name)
+            if fallback is None:
+                raise
+            logger.warning(f"Model {model_name} failed in {mode} mode with {type(e).__name__}, retrying on {fallback}")
+            return await self._invoke_model(get_model(fallback), messages, mode, fallback)
+    
+    async def _stream_routed(self, messages, on_event: Callable[[dict], None]) -> str:
+        """Stream a no-tools reply, retrying on the fallback if the model fails before any token is sent"""
+        model_name = self.router.choose("no_tools")
+        streamed = []  # tokens that reached the client
+        try:
+            return await self._stream_model(messages, model_name, on_event, streamed)
+        except RateLimitTimeout:
+            raise
+        except Exception as e:
+            fallback = self.router.fallback_for(model_name)
+            # Once tokens reached the client, switching models mid-reply would garble it
+            if fallback is None or streamed:
+                raise
+            logger.warning(f"Model {model_name} failed with {type(e).__name__} before streaming, retrying on {fallback}")
+            return await self._stream_model(messages, fallback, on_event, streamed)
+    
+    async def _stream_model(self, messages, model_name: str, on_event: Callable[[dict], None], streamed: list) -> str:
+        """Stream one model's reply within the OpenAI rate limits"""
+        # A retried stream starts over with a fresh model_start
+        async def stream_model():
+            on_event({"type": "model_start"})
+            started = time.monotonic()
+            content = ""
+            try:
+                async for chunk in self._chat_model(model_name).astream(messages):
+                    if isinstance(chunk.content, str) and chunk.content:
+                        on_event({"type": "token", "content": chunk.content})
+                        streamed.append(chunk.content)
+                        content += chunk.content
+                    # With stream_usage the final chunk carries the usage
+                    record_usage(chunk.usage_metadata)
+            except Exception:
+                self.router.record(model_name, time.monotonic() - started, error=True)
+                raise
+            self.router.record(model_name, time.monotonic() - started)
+            if is_recording():
+                record_event("model", started, response=message_to_dict(AIMessage(content=content)))
+            return content
+        try:
+            with LLM_CALL_SECONDS.time(mode="no_tools", model=model_name), span("model", "no_tools", model=model_name):
+                return await openai_limiter.call(stream_model, tokens=estimate_tokens(messages))
+        except Exception as e:
+            ERRORS.inc(stage="llm", error_type=type(e).__name__)
+            raise
+    
+    async def _invoke_model(self, model, messages, mode: str, model_name: str):
+        """Call the model within the OpenAI rate limits, then correct the token estimate"""
+        estimate = estimate_tokens(messages)
+        with span("model", mode, model=model_name, estimated_input_tokens=estimate) as attributes:
+            try:
+                with LLM_CALL_SECONDS.time(mode=mode, model=model_name):
+                    response = await openai_limiter.call(lambda: self._call_model(model, messages, model_name), tokens=estimate)
+            except Exception as e:
+                ERRORS.inc(stage="llm", error_type=type(e).__name__)
+                raise
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                openai_limiter.record_tokens(usage["total_tokens"] - estimate)
+                record_usage(usage)
+                attributes["input_tokens"] = usage["input_tokens"]
+                attributes["output_tokens"] = usage["output_tokens"]
+                attributes["cached_tokens"] = (usage.get("input_token_details") or {}).get("cache_read", 0)
+            attributes["tool_calls"] = len(getattr(response, "tool_calls", None) or [])
+        return response
+    
+    async def _call_model(self, model, messages, model_name: str):
+        started = time.monotonic()
+        try:
+            response = await model.ainvoke(messages)
+        except Exception:
+            self.router.record(model_name, time.monotonic() - started, error=True)
+            raise
+        # Measured per attempt, without rate limit waits, so it reflects the model itself
+        self.router.record(model_name, time.monotonic() - started)
+        if is_recording():
+            record_event("model", started, response=message_to_dict(response))
+        return response
+    
+    def get_usage_stats(self) -> dict:
+        """Get token usage and prompt cache hit ratio across all runs"""
+        return total_usage.to_dict()
+    
+    def get_model_stats(self) -> dict:
+        """Get the model routing table with per-model latency and error rates"""
+        return self.router.get_stats()
+    
+    def get_cache_stats(self) -> dict:
+        """Get graph cache size and hit rate"""
+        lookups = self.graph_cache_hits + self.graph_cache_misses
+        return {
+            "size": len(self._graph_cache),
+            "bound_models": len(self._bound_models),
+            "max_size": self.graph_cache_size,
+            "hits": self.graph_cache_hits,
+            "misses": self.graph_cache_misses,
+            "hit_rate": self.graph_cache_hits / lookups if lookups else 0.0,
+        }
+        
+    async def _stream_graph(self, graph, state, config, on_event: Callable[[dict], None]):
+        """Run the graph, reporting model tokens and tool calls as they happen"""
+        result = None
+        async for event in graph.astream_events(state, config=config, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_start":
+                on_event({"type": "model_start"})
+            elif kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if isinstance(content, str) and content:
+                    on_event({"type": "token", "content": content})
+            elif kind == "on_tool_start":
+                on_event({"type": "tool_start", "tool": event["name"]})
+            elif kind == "on_tool_end":
+                on_event({"type": "tool_end", "tool": event["name"]})
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                # The root graph run finishing carries the final state
+                result = event["data"]["output"]
+        return result
         
-    async def process_message(self, user_id: str, message: str) -> str:
-        """Process a user message"""
+    async def process_message(self, user_id: str, message: str, on_event: Optional[Callable[[dict], None]] = None) -> str:
+        """Process a user message, optionally reporting progress events to on_event"""
+        if is_research_trigger(message):
+            profile = self.profiles.get(user_id) if self.profiles is not None else None
+            if profile is not None:
+                # Greet from the stored profile; an expired one is refreshed for next time
+                if self.profiles.is_stale(profile):
+                    self.profiles.refresh(user_id, lambda: self._research(user_id, message))
+                logger.debug(f"Using stored research profile for user {user_id}")
+                return profile.response
+            return await self._research(user_id, message, on_event)
+        return await self._run(user_id, message, on_event)
+    
+    async def _research(self, user_id: str, message: str, on_event: Optional[Callable[[dict], None]] = None) -> str:
+        # Duplicate research triggers for a user share the run already in flight
+        return await research_runs.run(
+            user_id,
+            lambda publish: self._run(user_id, message, publish),
+            on_event,
+        )
+    
+    async def _run(self, user_id: str, message: str, on_event: Optional[Callable[[dict], None]]) -> str:
+        usage = TokenUsage()
+        token = run_usage.set(usage)
+        try:
+            with recording(user_id, message) as session:
+                response = await self._process_message(user_id, message, on_event)
+                if session is not None:
+                    session["response"] = response
+                return response
+        finally:
+            run_usage.reset(token)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.usage = usage.to_dict()
+            logger.debug(f"Token usage for user {user_id}: {usage.to_dict()}")
+    
+    async def _process_message(self, user_id: str, message: str, on_event: Optional[Callable[[dict], None]]) -> str:
         print(f"Debug: Processing message for user {user_id}")
         
         # Get Gmail and search tools for the user
         try:
-            from .tools import get_google_tools
-            tools = get_google_tools(self.composio, user_id)
+            from .tools import get_google_tools, run_in_executor, tool_cache, tool_results
+            
+            # Composio's SDK is synchronous; fetching and executing tools both
+            # go through the shared executor so they never block the event loop
+            async def fetch_tools():
+                started = time.monotonic()
+                tools = await composio_executor.run(get_google_tools, self.composio, user_id)
+                if is_recording():
+                    record_event("tool_fetch", started, tools=[convert_to_openai_tool(tool) for tool in tools])
+                return [run_in_executor(tool, composio_executor, user_id, tool_results) for tool in tools]
+            
+            with TOOL_FETCH_SECONDS.time(), span("tool_fetch", "tool_cache") as attributes:
+                tools = await tool_cache.get(user_id, fetch_tools)
+                attributes["tools"] = len(tools)
             print(f"Debug: Got {len(tools)} tools (Gmail + Search)")
             
         except Exception as e:
             print(f"Debug: No tools available: {e}")
+            ERRORS.inc(stage="tool_fetch", error_type=type(e).__name__)
             tools = []
         
         if tools:
-            # Create model with tools and build graph
-            model_with_tools = self.model.bind_tools(tools)
-            tool_node = ToolNode(tools)
-            
-            # Build simple graph with Poke personality
-            def call_model_with_system(state):
-                # Check if this is initial research or normal conversation
-                current_message = state["messages"][-1].content
-                is_research_mode = ("Hello Poke" in current_message or 
-                                  "SYSTEM: Perform initial research" in current_message or
-                                  "Research this user automatically" in current_message)
-                
-                if is_research_mode:
-                    system_content = """
-You are Poke 🌴 — a digital bouncer who sizes people up before deciding if they're worth your time. You research everyone who walks through your door using their Gmail data and web searches, then greet them with what you've found.
-
-## Your Core Identity
-You're like a bouncer at an exclusive club - you do your homework on everyone before they even get to talk. You start every interaction with "So you are [Full Name]" followed by what you've discovered about them. You're sizing them up, deciding if they're interesting enough to engage with. You're not eager to help - you're evaluating whether they deserve your attention.
-
-Your vibe: Cool, observant, slightly judgmental but not hostile. You speak like someone who's seen it all and can read people instantly. You're not trying to impress anyone - they need to impress you.
-
-## Research Strategy
-
-### Phase 1: Gmail Profile & Domain Analysis  
-- Get Gmail profile for name and basic details
-- **Analyze email domain** - if not generic provider (gmail, yahoo, outlook, hotmail, icloud), extract company name:
-  - john@acme.dev → company is likely "acme" 
-  - sarah@techstartup.ai → company is likely "techstartup"
-  - Skip generic providers: gmail.com, yahoo.com, outlook.com, hotmail.com, icloud.com, etc.
-- **Use GMAIL_SEARCH_PEOPLE** to search ONLY with the user's FULL NAME (not email address)
-- Look for professional profiles (LinkedIn, company pages, professional directories)
-- Extract PERSONAL professional details about them as an individual:
-  - Current company and job title (from any source)
-  - Their individual background, education, previous experience
-  - Their specific skills, technologies they work with personally
-  - Their personal projects, contributions, achievements
-  - Their role and what they personally do (not just company they work for)
-  - Location and experience level
-
-### Phase 2: Targeted Web Research
-- Use **COMPOSIO_SEARCH** with any gathered professional data AND email domain company
-- Search combinations like:
-  - "{User Name}" + "{Email Domain Company}" + recent news/achievements
-  - "{User Name}" + "{Personal Skills/Technologies}" + projects
-  - "{User Name}" + "{Education/Background}" + personal achievements  
-  - "{User Name}" + personal projects, contributions, or work they've done
-  - "{User Name}" + speaking, writing, or personal professional activities
-- Cross-reference multiple sources for consistency about THEM personally
-- Look for their individual work, personal projects, contributions
-- Find their speaking events, publications, personal professional activities
-- Gather information about THEM as a person, not just company news
-
-### Phase 3: Personal Profile Assembly
-- Cross-reference all gathered data from multiple sources about THEM personally
-- Verify their individual background, skills, and personal work across sources
-- Confirm their personal projects, achievements, and individual contributions
-- Build confident profile of THEM as a person, not their company
-
-## Available Tools
-- **GMAIL_SEARCH_PEOPLE**: Search using the user's COMPLETE FULL NAME (first name + last name together, NOT just first name) to find professional profiles and contact information
-- **GMAIL tools**: Profile access, basic Gmail functions  
-- **COMPOSIO_SEARCH**: Web search using any gathered professional details + user name for comprehensive research
-
-## Step-by-Step Process
-1. **Start with Gmail Profile** - Get basic name and email info
-2. **Analyze Email Domain** - Extract company name if not generic provider (gmail, yahoo, outlook, etc.)
-3. **Use GMAIL_SEARCH_PEOPLE** - CRITICAL: Always search using the user's COMPLETE FULL NAME (e.g., "John Smith", "Sarah Johnson") - NEVER use just first name ("John") or partial names. Use the exact full name format from Gmail profile.
-
-4. **Extract PERSONAL Details** - From any professional profiles found via people search:
-   - Their individual background, education, previous experience
-   - Their specific skills, technologies they personally work with
-   - Their personal projects, contributions, achievements
-   - What they personally do, not just company they work for
-5. **Execute COMPOSIO_SEARCH** - Use web search focused on THEM personally:
-   - User's full name + their personal skills/technologies + projects
-   - User's full name + their background + personal achievements
-   - User's full name + personal work, speaking, contributions
-   - Focus on THEM as a person, not company news
-6. **Cross-Verify & Present** - Build profile of THEM personally with verified evidence
-
-## Personality & Tone
-- **Like a friend who's looked you up**: Casual, conversational, naturally curious
-- **Casual confidence**: Present insights naturally, like you've been following them
-- **Contextually aware**: Make observations about why they're here or what they're doing
-- **Lightly cheeky**: Ask engaging questions that show you understand their space/work
-- **Not creepy**: Stay professional and work-focused, avoid personal/private details
-
-## Response Format
-Start with "So you are [Full Name]" then present what you've found about them like you're checking their credentials at the door:
-
-Structure:
-1. **Opening line**: "So you are [Full Name]..." 
-2. **What you found**: Present 2-3 key things about them (job, background, something interesting) in a matter-of-fact way
-3. **Your assessment**: A brief, non-committal observation about what kind of person they seem to be
-4. **The test**: End with something that gauges if they're worth talking to - could be a question, challenge, or comment that sees how they respond
-
-Tone examples:
-- "So you are John Smith, software engineer at TechCorp, been coding for 5 years, recently moved to Austin. Seems like another dev chasing the startup dream. What makes you different from the thousand other engineers I've seen this week?"
-- "So you are Sarah Johnson, marketing director at SaaS company, MBA from Wharton, writes about growth hacking. Another marketing person who thinks they've cracked the code. Prove me wrong."
-
-Keep it real, not hostile - you're just not easily impressed.
-
-## Research Accuracy Rules
-- **USE MULTIPLE SOURCES**: GMAIL_SEARCH_PEOPLE (with COMPLETE FULL NAME) + email domain analysis + web search for comprehensive research
-- Never claim knowledge you can't verify through multiple professional sources
-- **DO NOT** just read email content and make assumptions - get verified professional profile data
-- If multiple people have same name, use LinkedIn profile + email domain to confirm correct identity  
-- Cross-reference: LinkedIn company vs email domain company for consistency
-- Focus on verified professional information from LinkedIn, avoid personal details
-- When uncertain, ask one clarifying question rather than guess
-- Always have 2+ confirming data points from different sources before stating facts
-
-## Privacy Boundaries  
-- Stick to professional, publicly available information from various professional sources
-- **DO NOT reference private email contents** - use verified professional profiles and web sources
-- Focus on verified work info, achievements, company news, industry context from public sources
-- Avoid personal relationships, private activities, or sensitive details from emails
-
-                """
-                else:
-                    # Normal conversation mode
-                    system_content = """
-You are Poke 🌴 — a digital bouncer who has already sized up this person and decided they're worth talking to. You know who they are from your research. Now you're in conversation mode, but you maintain your cool, observant demeanor.
-
-## Your Personality
-You're still the same bouncer - you don't suddenly become eager or overly helpful. You engage because they passed your initial assessment, but you're not trying to win them over. You respond naturally, occasionally referencing what you know about them, but you're not showing off your research.
-
-## Conversation Style
-- Stay cool and measured in your responses
-- Don't repeat all your research - you already made your point
-- Answer their questions or respond to their comments, but don't be overly enthusiastic
-- Reference your knowledge of them only when it's actually relevant to what they're saying
-- Maintain that "I've seen it all" vibe without being dismissive
-
-## Tone Guidelines
-- You're engaged but not eager
-- You're helpful but not desperate to please
-- You remember who they are but don't constantly bring it up
-- You respond with the energy they bring - if they're casual, you're casual; if they're serious, you match that
-- You're confident in your responses because you know who you're talking to
-                """
-                
-                system_message = HumanMessage(content=system_content)
-                messages = [system_message] + state["messages"]
-                return {"messages": [model_with_tools.invoke(messages)]}
-            
-            workflow = StateGraph(MessagesState)
-            workflow.add_node("agent", call_model_with_system)
-            workflow.add_node("tools", tool_node)
-            workflow.add_edge(START, "agent")
-            workflow.add_conditional_edges("agent", tools_condition)
-            workflow.add_edge("tools", "agent")
-            
-            graph = workflow.compile()
+            graph = self._get_graph(tools)
             
             # Run the graph with automatic research trigger
-            if "Hello Poke" in message or "SYSTEM: Perform initial research" in message:
+            mode = "research" if is_research_trigger(message) else "conversation"
+            if mode == "research":
                 # Trigger automatic research
                 research_prompt = "Research this user automatically using their Gmail profile and web search. Find out who they are, where they work, what they do, and provide insights about them."
                 state = {"messages": [HumanMessage(content=research_prompt)]}
             else:
-                state = {"messages": [HumanMessage(content=message)]}
+                state = {"messages": self._profile_context(user_id) + [HumanMessage(content=message)]}
                 
-            result = await graph.ainvoke(state)
+            config = {"configurable": {"tool_node": ToolNode(tools), "mode": mode, "seen_results": set()}}
+            if on_event:
+                result = await self._stream_graph(graph, state, config, on_event)
+            else:
+                result = await graph.ainvoke(state, config=config)
             
-            if result["messages"]:
-                return result["messages"][-1].content
+            if result and result["messages"]:
+                response = result["messages"][-1].content
+                if mode == "research" and self.profiles is not None:
+                    tools_used = sorted({
+                        call["name"]
+                        for graph_message in result["messages"]
+                        for call in getattr(graph_message, "tool_calls", None) or []
+                    })
+                    # A run that never reached a tool found nothing worth keeping
+                    if tools_used:
+                        tool_messages = [m for m in result["messages"] if isinstance(m, ToolMessage) and isinstance(m.content, str)]
+                        profile = self.profiles.save(
+                            user_id,
+                            response,
+                            tools_used,
+                            sources=collect_sources(m.content for m in tool_messages if (m.name or "").startswith("COMPOSIO_SEARCH")),
+                            email=profile_email(m.content for m in tool_messages if m.name == "GMAIL_GET_PROFILE"),
+                        )
+                        self.profiles.extract(user_id, profile, lambda: self._extract_findings(response))
+                return response
         else:
             # No tools - use basic model
-            response = await self.model.ainvoke([HumanMessage(content=message)])
+            messages = self._profile_context(user_id) + [HumanMessage(content=message)]
+            if on_event:
+                return await self._stream_routed(messages, on_event)
+            response = await self._invoke_routed(self._chat_model, messages, "no_tools")
             return response.content
             
         return "I'm here to help!"
     
+    def _profile_context(self, user_id: str) -> list:
+        """Stored research findings for a conversation turn.
+
+        Sent after the system prompt so the cached prompt prefix stays the same for every user.
+        """
+        profile = self.profiles.peek(user_id) if self.profiles is not None else None
+        return [SystemMessage(content=format_profile(profile))] if profile is not None else []
+    
+    async def _extract_findings(self, response: str) -> dict:
+        """Structured findings (name, company, role, ...) from a research greeting"""
+        messages = [SystemMessage(content=RESEARCH_EXTRACTION_PROMPT), HumanMessage(content=response)]
+        reply = await self._invoke_routed(self._chat_model, messages, "no_tools")
+        return parse_findings(reply.content if isinstance(reply.content, str) else "")
+    
     async def send_proactive_message(self, user_id: str) -> str:
         """Send a proactive message"""
         return "How can I help you today?"
\ No newline at end of file
@@ -1,15 +1,23 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import asyncio
+import json
 
 from .models import User, UserMemory
 from .message_processor import MessageProcessor
+from .message_queue import create_message_queue, QueueFullError
 from .connection import initiate_connection, get_connection_status
-from composio import Composio
+from .tools import tool_cache, tool_results
+from .events import TERMINAL_EVENTS
+from .executor import composio_executor, ExecutorBusyError
+from .connection_watcher import ConnectionWatcher
+from .storage import create_storage, StoredDict
+from .metrics import REGISTRY
+from .constants import get_composio
 from typing import Dict
-from collections import deque
 
 app = FastAPI(title="Poke AI Backend", version="1.0.0")
 
@@ -22,14 +30,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple in-memory storage - no Redis needed
-users: Dict[str, User] = {}
-memories: Dict[str, UserMemory] = {}
-message_queue = deque()
+# Users, memories and responses live in memory with write-behind to storage
+storage = create_storage()
+users: Dict[str, User] = StoredDict(storage, "users", User)
+memories: Dict[str, UserMemory] = StoredDict(storage, "memories", UserMemory)
+message_queue = create_message_queue()
+connection_users: Dict[str, str] = {}  # connection_id -> user_id
+connection_statuses: Dict[str, str] = {}  # connection_id -> last seen status
 
 # Global instances
-message_processor = MessageProcessor(message_queue, users, memories)
-composio_client = Composio()
+message_processor = MessageProcessor(message_queue, users, memories, storage=storage)
+
+
+def record_connection_status(connection_id: str, status: str):
+    """Track a connection's status, refetching its user's tools when it changes.
+    
+    A connection turning ACTIVE starts the user's research right away, so the
+    greeting is usually ready by the time the client asks for it.
+    """
+    if connection_statuses.get(connection_id) != status:
+        connection_statuses[connection_id] = status
+        user_id = connection_users.get(connection_id)
+        if user_id:
+            tool_cache.invalidate(user_id)
+            tool_results.invalidate(user_id)
+            if status == "ACTIVE":
+                message_processor.prefetch_research(user_id)
+
+
+async def fetch_connection_status(connection_id: str) -> str:
+    # The client is resolved in the worker thread; building it is slow on first use
+    status = await composio_executor.run(
+        lambda: get_connection_status(
+            connected_account_id=connection_id,
+            composio_client=get_composio()
+        )
+    )
+    return status.status
+
+
+connection_watcher = ConnectionWatcher(fetch_connection_status, on_status=record_connection_status)
+
+# Longest a status request may be held open in wait mode
+MAX_STATUS_WAIT_SECONDS = 60.0
 
 # Request/Response models
 class UserCreateRequest(BaseModel):
@@ -49,14 +92,21 @@ class ConnectionRequest(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    """Start the message processor when the API starts"""
-    asyncio.create_task(message_processor.start_processing())
+    """Warm up and start the message processor once the API is serving"""
+    async def warm_up_and_start():
+        await message_processor.warm_up()
+        await message_processor.start_processing()
+    
+    asyncio.create_task(warm_up_and_start())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Stop the message processor when the API shuts down"""
     await message_processor.stop_processing()
+    composio_executor.shutdown()
+    message_queue.close()
+    storage.close()
 
 
 @app.post("/users", response_model=dict)
@@ -69,6 +119,8 @@ async def create_user(request: UserCreateRequest):
         )
         
         users[user.connection_id] = user
+        # Other server processes read the user from disk
+        await asyncio.to_thread(storage.flush)
         return {"user_id": user.connection_id}
             
     except Exception as e:
@@ -95,33 +147,51 @@ async def get_user(user_id: str):
 async def initiate_user_connection(request: ConnectionRequest):
     """Initiate Gmail connection for user"""
     try:
-        connected_account = initiate_connection(
-            user_id=request.user_id,
-            composio_client=composio_client,
-            auth_config_id=request.auth_config_id
+        connected_account = await composio_executor.run(
+            lambda: initiate_connection(
+                user_id=request.user_id,
+                composio_client=get_composio(),
+                auth_config_id=request.auth_config_id
+            )
         )
         
+        connection_users[connected_account.id] = request.user_id
+        tool_cache.invalidate(request.user_id)
+        tool_results.invalidate(request.user_id)
+        
         return {
             "connection_id": connected_account.id,
             "redirect_url": connected_account.redirect_url,
         }
         
+    except (asyncio.TimeoutError, ExecutorBusyError):
+        raise HTTPException(status_code=503, detail="Connection service is busy, please retry")
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail="Connection failed")
 
 
 @app.get("/connections/{connection_id}/status")
-async def check_connection_status(connection_id: str):
-    """Check connection status"""
+async def check_connection_status(connection_id: str, wait: bool = False, timeout: float = 30.0):
+    """Check connection status.
+    
+    With ``wait=true`` the request is held open for up to ``timeout`` seconds
+    until the connection reaches a terminal status such as ACTIVE.
+    """
     try:
-        status = get_connection_status(
-            connected_account_id=connection_id,
-            composio_client=composio_client
-        )
+        status = None
+        if wait:
+            timeout = min(max(timeout, 0.0), MAX_STATUS_WAIT_SECONDS)
+            status = await connection_watcher.wait(connection_id, timeout)
         
-        return {"status": status.status, "connection_id": connection_id}
+        if status is None:
+            status = await fetch_connection_status(connection_id)
+            record_connection_status(connection_id, status)
         
+        return {"status": status, "connection_id": connection_id}
+        
+    except (asyncio.TimeoutError, ExecutorBusyError):
+        raise HTTPException(status_code=503, detail="Connection service is busy, please retry")
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail="Unable to check connection status")
@@ -146,6 +216,13 @@ async def send_message(request: MessageRequest):
             
     except HTTPException:
         raise
+    except QueueFullError as e:
+        # Shed load early; Retry-After is estimated from backlog and processing rate
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after or 1)},
+        )
     except Exception as e:
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail="Message processing failed")
@@ -155,7 +232,7 @@ async def send_message(request: MessageRequest):
 async def get_message_response(message_id: str):
     """Get response for a specific message"""
     try:
-        response_data = message_processor.get_message_response(message_id)
+        response_data = await message_processor.get_message_response(message_id)
         if response_data.get("status") == "not_found":
             raise HTTPException(status_code=404, detail="Message not found")
         return response_data
@@ -166,6 +243,53 @@ async def get_message_response(message_id: str):
         raise HTTPException(status_code=500, detail="Failed to get message response")
 
 
+def _sse(event: dict) -> str:
+    """Format an event as a Server-Sent Events frame.
+    
+    The event type travels in the payload rather than the SSE ``event:`` field,
+    because browsers reserve the ``error`` event name for connection failures.
+    """
+    return f"data: {json.dumps(event)}\n\n"
+
+
+@app.get("/messages/{message_id}/trace")
+async def get_message_trace(message_id: str):
+    """Get the execution timeline (graph steps, model and tool calls) of a message"""
+    trace = message_processor.get_message_trace(message_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+
+@app.get("/messages/{message_id}/stream")
+async def stream_message_response(message_id: str):
+    """Stream progress events and model tokens for a message as Server-Sent Events"""
+    # Subscribe before yielding control so no event can be missed
+    queue = message_processor.events.subscribe(message_id)
+    response_data = await message_processor.get_message_response(message_id)
+    if response_data.get("status") == "not_found":
+        message_processor.events.unsubscribe(message_id, queue)
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    async def event_stream():
+        if response_data.get("status") in TERMINAL_EVENTS:
+            message_processor.events.unsubscribe(message_id, queue)
+            yield _sse({"type": response_data["status"], "response": response_data["response"]})
+            return
+        
+        async for event in message_processor.events.stream(message_id, queue):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield _sse(event)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/users/{user_id}/memory")
 async def get_user_memory(user_id: str):
     """Get user memory and insights"""
@@ -192,7 +316,45 @@ async def get_user_conversations(user_id: str):
         raise HTTPException(status_code=500, detail="Unable to retrieve conversations")
 
 
+@app.get("/processor/stats")
+async def get_processor_stats():
+    """Get message processor worker pool statistics"""
+    return {
+        **await message_processor.get_worker_stats(),
+        "connection_watcher": connection_watcher.get_stats(),
+    }
+
+
+@app.get("/processor/dead-letters")
+async def get_dead_letters():
+    """Get messages that failed on every processing attempt"""
+    return {"dead_letters": await message_processor.get_dead_letters()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Get pipeline metrics in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check: 503 until the processor has finished warming up"""
+    if message_processor.ready:
+        status = "ready"
+    elif message_processor.warm_up_error:
+        status = "warm_up_failed"
+    else:
+        status = "warming_up"
+    body = {
+        "status": status,
+        "warm_up_seconds": message_processor.warm_up_seconds,
+        "warm_up_error": message_processor.warm_up_error,
+    }
+    return JSONResponse(body, status_code=200 if message_processor.ready else 503)
\ No newline at end of file
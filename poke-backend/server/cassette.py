@@ -0,0 +1,96 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Session of the message being recorded, if recording is enabled
+_session: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("cassette_session", default=None)
+
+
+class CassetteRecorder:
+    """Records agent runs into a cassette for offline replay.
+
+    Each ``PokeAgent.process_message`` call becomes one JSON line holding the
+    incoming message, its arrival offset, and every tool fetch, model call
+    and tool call made on its behalf with their results and timings.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.sessions = 0
+
+    @contextmanager
+    def session(self, user_id: str, message: str):
+        started = time.monotonic()
+        session = {
+            "user_id": user_id,
+            "message": message,
+            "offset": started - self._started,
+            "events": [],
+        }
+        token = _session.set(session)
+        try:
+            yield session
+        except Exception as e:
+            session["error"] = type(e).__name__
+            raise
+        finally:
+            _session.reset(token)
+            session["duration"] = time.monotonic() - started
+            self._write(session)
+
+    def _write(self, session: dict) -> None:
+        try:
+            line = json.dumps(session, default=str)
+            with self._lock:
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+            self.sessions += 1
+        except Exception as e:
+            logger.error(f"Error writing cassette session: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+
+
+def is_recording() -> bool:
+    return _session.get() is not None
+
+
+def record_event(kind: str, started: float, **data) -> None:
+    """Add a model or tool event to the session being recorded, if any"""
+    session = _session.get()
+    if session is None:
+        return
+    now = time.monotonic()
+    session["events"].append({
+        "kind": kind,
+        "duration": now - started,
+        **data,
+    })
+
+
+@contextmanager
+def recording(user_id: str, message: str):
+    """Record the enclosed agent run when POKE_RECORD_CASSETTE is set"""
+    if recorder is None:
+        yield None
+        return
+    with recorder.session(user_id, message) as session:
+        yield session
+
+
+def load_cassette(path: str) -> List[dict]:
+    """Read the recorded sessions of a cassette, in arrival order"""
+    with open(path) as f:
+        sessions = [json.loads(line) for line in f if line.strip()]
+    return sorted(sessions, key=lambda session: session["offset"])
+
+
+recorder = CassetteRecorder(os.environ["POKE_RECORD_CASSETTE"]) if os.getenv("POKE_RECORD_CASSETTE") else None
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from .metrics import TOOL_OUTPUT_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Per-tool compaction rules:
+#   fields     keys kept on list items that have any of them (field projection)
+#   drop       keys removed wherever they appear
+#   max_items  items kept per list
+#   max_text   characters kept per string value
+#   max_bytes  cap on the whole serialized result
+#   dedupe     item key used to drop hits already returned earlier in the run
+DEFAULT_RULE = {"max_text": 2000, "max_items": 20, "max_bytes": 12000}
+
+TOOL_RULES: Dict[str, dict] = {
+    "GMAIL_GET_EMAIL_THREAD": {
+        "fields": ["messageId", "threadId", "sender", "to", "subject", "messageTimestamp", "messageText", "preview"],
+        "drop": ["payload", "attachmentList", "labelIds", "display_url"],
+        "max_items": 10,
+        "max_text": 1500,
+        "max_bytes": 10000,
+    },
+    "COMPOSIO_SEARCH_SEARCH": {
+        "fields": ["title", "url", "link", "snippet", "text", "summary", "highlights", "publishedDate", "author"],
+        "max_items": 8,
+        "max_text": 600,
+        "max_bytes": 8000,
+        "dedupe": "url",
+    },
+    "COMPOSIO_SEARCH_EXA_SIMILARLINK": {
+        "fields": ["title", "url", "text", "summary", "highlights", "publishedDate", "author"],
+        "max_items": 8,
+        "max_text": 600,
+        "max_bytes": 8000,
+        "dedupe": "url",
+    },
+    "COMPOSIO_SEARCH_EXA_ANSWER": {
+        "fields": ["title", "url", "text", "publishedDate", "author"],
+        "max_items": 8,
+        "max_text": 800,
+        "max_bytes": 8000,
+        "dedupe": "url",
+    },
+}
+
+
+def _load_rules() -> Dict[str, dict]:
+    """Code defaults, overridden per tool by the POKE_TOOL_COMPACTION JSON object"""
+    rules = {name: dict(rule) for name, rule in TOOL_RULES.items()}
+    overrides = os.getenv("POKE_TOOL_COMPACTION")
+    if overrides:
+        try:
+            for name, rule in json.loads(overrides).items():
+                rules.setdefault(name, {}).update(rule)
+        except Exception as e:
+            logger.error(f"Ignoring invalid POKE_TOOL_COMPACTION: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+    return rules
+
+
+class ToolOutputCompactor:
+    """Shrinks tool results before they are added to the agent's messages.
+
+    Every later model call in the run re-sends earlier tool results, so raw
+    Composio JSON (email MIME payloads, full page text of search hits) is
+    paid for on every turn. ``seen`` is a per-run set used to drop search
+    hits the model has already been shown.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, dict]] = None, enabled: Optional[bool] = None):
+        self.rules = rules if rules is not None else _load_rules()
+        self.enabled = enabled if enabled is not None else os.getenv("POKE_TOOL_COMPACTION_ENABLED", "true") == "true"
+        self.compacted = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.duplicates_dropped = 0
+
+    def compact(self, tool_name: str, content: str, seen: Set[str]) -> str:
+        rule = {**DEFAULT_RULE, **self.rules.get(tool_name, {})}
+        try:
+            data = json.loads(content)
+        except (TypeError, ValueError):
+            data = None
+
+        if isinstance(data, (dict, list)):
+            compacted = json.dumps(self._compact_value(data, rule, seen), ensure_ascii=False, separators=(",", ":"))
+        else:
+            compacted = content
+
+        max_bytes = rule["max_bytes"]
+        if len(compacted.encode()) > max_bytes:
+            compacted = compacted.encode()[:max_bytes].decode(errors="ignore") + " ...[truncated]"
+        return compacted
+
+    def _compact_value(self, value: Any, rule: dict, seen: Set[str]) -> Any:
+        if isinstance(value, dict):
+            drop = rule.get("drop", ())
+            return {key: self._compact_value(item, rule, seen) for key, item in value.items() if key not in drop}
+        if isinstance(value, list):
+            return self._compact_list(value, rule, seen)
+        if isinstance(value, str):
+            return self._truncate(value, rule["max_text"])
+        return value
+
+    def _compact_list(self, items: List[Any], rule: dict, seen: Set[str]) -> List[Any]:
+        fields = set(rule.get("fields", ()))
+        dedupe = rule.get("dedupe")
+        kept, duplicates, omitted = [], 0, 0
+        for item in items:
+            key = None
+            if isinstance(item, dict):
+                if fields and fields & item.keys():
+                    item = {key: value for key, value in item.items() if key in fields}
+                key = item.get(dedupe) if dedupe else None
+                if isinstance(key, str) and key in seen:
+                    duplicates += 1
+                    continue
+            if len(kept) >= rule["max_items"]:
+                omitted += 1
+                continue
+            # Only hits actually shown to the model count as seen
+            if isinstance(key, str):
+                seen.add(key)
+            kept.append(self._compact_value(item, rule, seen))
+
+        self.duplicates_dropped += duplicates
+        if duplicates:
+            kept.append(f"({duplicates} results already shown earlier omitted)")
+        if omitted:
+            kept.append(f"({omitted} more results omitted)")
+        return kept
+
+    @staticmethod
+    def _truncate(text: str, limit: int) -> str:
+        if len(text) <= limit:
+            return text
+        return f"{text[:limit]}... [{len(text) - limit} more characters]"
+
+    def compact_messages(self, messages: list, seen: Set[str]) -> list:
+        """Compact the ToolMessages produced by one tools step"""
+        if not self.enabled:
+            return messages
+        compacted = []
+        for message in messages:
+            if getattr(message, "type", None) != "tool" or not isinstance(message.content, str) or message.status == "error":
+                compacted.append(message)
+                continue
+            content = self.compact(message.name, message.content, seen)
+            before, after = len(message.content.encode()), len(content.encode())
+            self.compacted += 1
+            self.bytes_in += before
+            self.bytes_out += after
+            TOOL_OUTPUT_BYTES.inc(before, tool=message.name, stage="raw")
+            TOOL_OUTPUT_BYTES.inc(after, tool=message.name, stage="compacted")
+            compacted.append(message.model_copy(update={"content": content}))
+        return compacted
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "compacted": self.compacted,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "duplicates_dropped": self.duplicates_dropped,
+        }
+
+
+compactor = ToolOutputCompactor()
@@ -1,10 +1,13 @@
-from composio import Composio
+from typing import TYPE_CHECKING
 import os
 
+if TYPE_CHECKING:
+    from composio import Composio
+
 def get_connection(
     connection_id: str,
     user_id: str,
-    composio_client: Composio,
+    composio_client: "Composio",
 ):
     return composio_client.connected_accounts.get(
         user_id,
@@ -12,7 +15,7 @@ def get_connection(
 
 def initiate_connection(
     user_id: str,
-    composio_client: Composio,
+    composio_client: "Composio",
     auth_config_id: str = None, 
 ):
     if not auth_config_id:
@@ -34,7 +37,7 @@ def initiate_connection(
 
 def wait_for_connection(
     connected_account_id: str,
-    composio_client: Composio,
+    composio_client: "Composio",
 ):
     return composio_client.connected_accounts.wait_for_connection(
         connected_account_id
@@ -42,7 +45,7 @@ def wait_for_connection(
 
 def get_connection_status(
     connected_account_id: str,
-    composio_client: Composio,
+    composio_client: "Composio",
 ):
     return composio_client.connected_accounts.get(
         nanoid=connected_account_id
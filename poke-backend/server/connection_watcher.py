@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which a connection will not change without user action
+TERMINAL_STATUSES = {"ACTIVE", "FAILED", "EXPIRED"}
+
+
+class _Watch:
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class ConnectionWatcher:
+    """Long-poll support for connection status.
+
+    All clients waiting on the same connection share one upstream poller,
+    which stops once the connection reaches a terminal status or nobody is
+    waiting any more.
+    """
+
+    def __init__(
+        self,
+        fetch_status: Callable[[str], Awaitable[str]],
+        on_status: Optional[Callable[[str, str], None]] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        self.fetch_status = fetch_status
+        self.on_status = on_status
+        self.poll_interval = poll_interval or float(os.getenv("POKE_CONNECTION_POLL_INTERVAL", "2"))
+        self.latest: Dict[str, str] = {}
+        self._watches: Dict[str, _Watch] = {}
+        self.upstream_polls = 0
+
+    async def wait(self, connection_id: str, timeout: float) -> Optional[str]:
+        """Wait up to ``timeout`` seconds for a terminal status, returning the latest status seen"""
+        watch = self._watches.get(connection_id)
+        if watch is None:
+            watch = _Watch(asyncio.get_running_loop().create_future())
+            self._watches[connection_id] = watch
+            watch.task = asyncio.create_task(self._poll(connection_id, watch))
+
+        watch.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(watch.future), timeout)
+        except asyncio.TimeoutError:
+            return self.latest.get(connection_id)
+        finally:
+            watch.waiters -= 1
+
+    async def _poll(self, connection_id: str, watch: _Watch) -> None:
+        try:
+            while True:
+                try:
+                    status = await self.fetch_status(connection_id)
+                    self.upstream_polls += 1
+                    self.latest[connection_id] = status
+                    if self.on_status:
+                        self.on_status(connection_id, status)
+                    if status in TERMINAL_STATUSES:
+                        watch.future.set_result(status)
+                        return
+                except Exception as e:
+                    logger.error(f"Error polling connection {connection_id}: {type(e).__name__}")
+                    logger.debug(f"Full error details: {e}")
+
+                if watch.waiters == 0:
+                    return
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            self._watches.pop(connection_id, None)
+            if not watch.future.done():
+                watch.future.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "active_watches": len(self._watches),
+            "waiters": sum(watch.waiters for watch in self._watches.values()),
+            "upstream_polls": self.upstream_polls,
+        }
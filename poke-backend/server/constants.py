@@ -1,18 +1,66 @@
-from composio import Composio
-from composio_langchain import LangchainProvider
-from langchain_openai import ChatOpenAI
 import os
-from dotenv import load_dotenv
+import threading
+from typing import Optional
 
-# Load environment variables
-load_dotenv()
+# The SDK clients (and the heavy composio/langchain imports behind them) are
+# built on first use, so importing the server stays fast
+_clients = {}
+_clients_lock = threading.Lock()
 
-composio = Composio(
-    api_key=os.getenv("COMPOSIO_API_KEY"),
-    provider=LangchainProvider(),
-)
 
-openai = ChatOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model='gpt-5'
-)
\ No newline at end of file
+def get_composio():
+    """Get the shared Composio client, creating it on first use"""
+    with _clients_lock:
+        if "composio" not in _clients:
+            from composio import Composio
+            from composio_langchain import LangchainProvider
+
+            _clients["composio"] = Composio(
+                api_key=os.getenv("COMPOSIO_API_KEY"),
+                provider=LangchainProvider(),
+            )
+        return _clients["composio"]
+
+
+# Model used wherever no per-mode model is configured
+DEFAULT_MODEL = os.getenv("POKE_MODEL", "gpt-5")
+
+
+def get_openai(model: Optional[str] = None):
+    """Get the shared chat model for ``model`` (the default model if omitted), creating it on first use"""
+    model = model or DEFAULT_MODEL
+    with _clients_lock:
+        # An overriding client stands in for every model
+        if "openai" in _clients:
+            return _clients["openai"]
+        key = f"openai:{model}"
+        if key not in _clients:
+            from langchain_openai import ChatOpenAI
+
+            _clients[key] = ChatOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                model=model,
+                # Report token usage for streamed responses too
+                stream_usage=True,
+                # Retries are handled by the rate limiter so they respect the message time budget
+                max_retries=0,
+            )
+        return _clients[key]
+
+
+def override_clients(openai=None, composio=None):
+    """Replace the shared clients, e.g. with local fakes for benchmarks"""
+    with _clients_lock:
+        if openai is not None:
+            _clients["openai"] = openai
+        if composio is not None:
+            _clients["composio"] = composio
+
+
+def __getattr__(name):
+    # Keep `from .constants import composio, openai` working
+    if name == "composio":
+        return get_composio()
+    if name == "openai":
+        return get_openai()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,72 @@
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+# Event types that end a message's stream
+TERMINAL_EVENTS = {"completed", "error"}
+
+
+class MessageEventBroker:
+    """Fan-out of per-message progress events to streaming subscribers.
+
+    Events published while a message is in flight are kept so a client that
+    subscribes late still sees the run from the start. History is dropped once
+    the message reaches a terminal event; the response store has the result.
+    """
+
+    def __init__(self, max_history: Optional[int] = None):
+        self.max_history = max_history or int(os.getenv("POKE_STREAM_MAX_HISTORY", "2000"))
+        self._history: Dict[str, List[dict]] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def publish(self, message_id: str, event: dict) -> None:
+        """Publish an event for a message to all current subscribers"""
+        history = self._history.setdefault(message_id, [])
+        if len(history) < self.max_history:
+            history.append(event)
+
+        for queue in self._subscribers.get(message_id, []):
+            queue.put_nowait(event)
+
+        if event.get("type") in TERMINAL_EVENTS:
+            self._history.pop(message_id, None)
+
+    def subscribe(self, message_id: str) -> asyncio.Queue:
+        """Register a subscriber, pre-filled with the events published so far"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self._history.get(message_id, []):
+            queue.put_nowait(event)
+        self._subscribers.setdefault(message_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, message_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(message_id, [])
+        if queue in subscribers:
+            subscribers.remove(queue)
+        if not subscribers:
+            self._subscribers.pop(message_id, None)
+
+    async def stream(self, message_id: str, queue: asyncio.Queue, keepalive: float = 15.0) -> AsyncIterator[Optional[dict]]:
+        """Yield events from a subscription until a terminal event.
+
+        Yields ``None`` when no event arrived within ``keepalive`` seconds so the
+        caller can write a keep-alive to the connection.
+        """
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event.get("type") in TERMINAL_EVENTS:
+                    return
+        finally:
+            self.unsubscribe(message_id, queue)
+
+    def get_stats(self) -> dict:
+        return {
+            "active_messages": len(self._history),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+        }
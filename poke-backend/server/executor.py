@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .rate_limit import UpstreamLimiter, composio_limiter
+
+
+class ExecutorBusyError(Exception):
+    """Raised when too many calls are already waiting for an executor slot"""
+
+
+class BlockingCallExecutor:
+    """Bounded thread pool for blocking SDK calls made from async code.
+
+    At most ``max_workers`` calls run at once; further calls wait for a slot,
+    and once ``max_queue`` calls are waiting new ones are rejected. Each call
+    has a timeout covering both the wait and the run. A call that times out
+    keeps its slot until the underlying thread actually returns. With a
+    ``limiter`` every call also goes through its rate limits and retries.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        max_queue: int,
+        default_timeout: float,
+        limiter: Optional[UpstreamLimiter] = None,
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.limiter = limiter
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(max_workers)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_run_seconds = 0.0
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """Run ``fn(*args, **kwargs)`` in the pool and await its result"""
+        if self.limiter:
+            return await self.limiter.call(lambda: self._run(fn, *args, timeout=timeout, **kwargs))
+        return await self._run(fn, *args, timeout=timeout, **kwargs)
+
+    async def _run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusyError(f"{self.name} executor has {self.queued} calls waiting")
+
+        loop = asyncio.get_running_loop()
+        timeout = timeout if timeout is not None else self.default_timeout
+        deadline = loop.time() + timeout
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        started = time.monotonic()
+        # Run in a copy of the caller's context, like asyncio.to_thread
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self._executor, functools.partial(context.run, fn, *args, **kwargs))
+        future.add_done_callback(functools.partial(self._release, started))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def _release(self, started: float, future: asyncio.Future) -> None:
+        self.in_flight -= 1
+        self.total_run_seconds += time.monotonic() - started
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self._slots.release()
+
+    def get_stats(self) -> dict:
+        """Get pool occupancy, queue depth and outcome counters"""
+        finished = self.completed + self.failed
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "avg_run_seconds": self.total_run_seconds / finished if finished else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared executor for every Composio SDK call (connections, tool fetch, tool execution)
+composio_executor = BlockingCallExecutor(
+    "composio",
+    max_workers=int(os.getenv("POKE_COMPOSIO_MAX_WORKERS", "16")),
+    max_queue=int(os.getenv("POKE_COMPOSIO_MAX_QUEUE", "256")),
+    default_timeout=float(os.getenv("POKE_COMPOSIO_TIMEOUT", "30")),
+    limiter=composio_limiter,
+)
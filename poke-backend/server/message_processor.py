@@ -1,59 +1,253 @@
 import asyncio
-from typing import Optional
+from typing import Optional, Dict
 import logging
-from .agent import PokeAgent
+import math
+import os
+import time
+from .prompts import RESEARCH_TRIGGER, is_research_trigger
 from .models import Message, User
+from .message_queue import MessageQueue, QueueFullError, PRIORITY_CONVERSATION, PRIORITY_RESEARCH
+from .tools import tool_cache, tool_results
+from .compaction import compactor
+from .events import TERMINAL_EVENTS, MessageEventBroker
+from .response_store import ERROR_RESPONSE, ResponseStore
+from .storage import Storage
+from .executor import composio_executor
+from .metrics import ERRORS, MESSAGES_IN_FLIGHT, MESSAGE_SECONDS, QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+from .tracing import TraceStore, current_trace
+from .rate_limit import composio_limiter, message_deadline, openai_limiter
+from .research import ResearchProfiles, research_runs
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class MessageProcessor:
-    def __init__(self, message_queue, users, memories):
-        self.agent = PokeAgent()
+    def __init__(
+        self,
+        message_queue: MessageQueue,
+        users,
+        memories,
+        num_workers: Optional[int] = None,
+        storage: Optional[Storage] = None,
+    ):
+        self._agent = None  # Built on first use or during warm_up(); importing it is slow
+        self.ready = False
+        self.warm_up_seconds: Optional[float] = None
+        self.warm_up_error: Optional[str] = None
         self.message_queue = message_queue
         self.users = users
         self.memories = memories
         self.processing = False
-        self.message_responses = {}  # Track responses by message_id
+        self.storage = storage or Storage()
+        self.message_responses = ResponseStore(storage=self.storage)  # Track responses by message_id
+        self.message_queue.on_dead_letter = self._on_dead_letter
+        self.events = MessageEventBroker()  # Live progress events by message_id
+        self.traces = TraceStore()  # Execution timelines by message_id
+        self.research_profiles = ResearchProfiles(memories)  # Research results reused for greetings
+        # Start research as soon as a user's Gmail connection becomes active
+        self.speculative_research = os.getenv("POKE_SPECULATIVE_RESEARCH", "true") == "true"
+        self.prefetches = 0
+        self.num_workers = num_workers or int(os.getenv("POKE_NUM_WORKERS", "4"))
+        self.lease_heartbeat = float(os.getenv("POKE_QUEUE_HEARTBEAT", "60"))
+        # Time budget for answering one message; upstream retries stop once it is spent
+        self.message_timeout = float(os.getenv("POKE_MESSAGE_TIMEOUT", "300"))
+        # Moving average of agent run time, used to estimate Retry-After
+        self.avg_processing_seconds = float(os.getenv("POKE_INITIAL_PROCESSING_ESTIMATE", "10"))
+        self.workers = []
+        self.worker_stats: Dict[int, dict] = {}
+        QUEUE_DEPTH.set_function(lambda: self.message_queue.depth)
+        MESSAGES_IN_FLIGHT.set_function(
+            lambda: sum(1 for stats in self.worker_stats.values() if stats["status"] == "busy")
+        )
+    
+    @property
+    def agent(self):
+        if self._agent is None:
+            from .agent import PokeAgent
+            self._agent = PokeAgent(profiles=self.research_profiles)
+        return self._agent
+    
+    async def warm_up(self):
+        """Import the agent stack and build the SDK clients off the event loop"""
+        started = time.monotonic()
+        try:
+            def load():
+                agent = self.agent
+                agent.warm_up_models()
+                agent.composio
+            await asyncio.to_thread(load)
+            self.ready = True
+        except Exception as e:
+            # Stay not ready; clients are retried on first use
+            self.warm_up_error = type(e).__name__
+            logger.error(f"Error warming up message processor: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+        self.warm_up_seconds = time.monotonic() - started
+        logger.info(f"Message processor warm-up finished in {self.warm_up_seconds:.2f}s")
     
     async def start_processing(self):
-        """Start the message processing loop"""
+        """Start the worker pool that drains the message queue"""
         self.processing = True
-        logger.info("Starting message processor...")
+        logger.info(f"Starting message processor with {self.num_workers} workers...")
+        # Responses other processes store arrive on the storage thread
+        loop = asyncio.get_running_loop()
+        self.message_responses.on_change = lambda: loop.call_soon_threadsafe(self._apply_remote_responses)
+        
+        self.workers = [
+            asyncio.create_task(self._worker(worker_id))
+            for worker_id in range(self.num_workers)
+        ]
+        await asyncio.gather(*self.workers, return_exceptions=True)
+    
+    async def _worker(self, worker_id: int):
+        """Worker loop: pop messages from the shared queue until stopped"""
+        stats = self.worker_stats[worker_id] = {
+            "worker_id": worker_id,
+            "status": "idle",
+            "current_message_id": None,
+            "processed": 0,
+            "errors": 0,
+            "busy_seconds": 0.0,
+            "last_wait_seconds": None,
+            "last_message_at": None,
+        }
         
         while self.processing:
             try:
-                # Get next message from queue
-                try:
-                    message = self.message_queue.pop()
-                except IndexError:
-                    message = None
+                # Block until a message is queued; workers wake immediately
+                message, waited = await self.message_queue.get()
                 
-                if message:
-                    await self._process_message(message)
+                stats["status"] = "busy"
+                stats["current_message_id"] = message.message_id
+                stats["last_wait_seconds"] = waited
+                QUEUE_WAIT_SECONDS.observe(waited)
+                started = time.monotonic()
+                success = False
+                try:
+                    success = await self._process_message(message, waited)
+                finally:
+                    elapsed = time.monotonic() - started
+                    stats["busy_seconds"] += elapsed
+                    self.avg_processing_seconds = 0.8 * self.avg_processing_seconds + 0.2 * elapsed
+                    MESSAGE_SECONDS.observe(waited + elapsed, outcome="completed" if success else "failed")
+                    stats["status"] = "idle"
+                    stats["current_message_id"] = None
+                    stats["last_message_at"] = __import__('datetime').datetime.now().isoformat()
+                if success:
+                    stats["processed"] += 1
                 else:
-                    # No messages, wait
-                    await asyncio.sleep(1)
+                    stats["errors"] += 1
                     
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Error in message processing loop: {type(e).__name__}")
+                logger.error(f"Error in worker {worker_id} processing loop: {type(e).__name__}")
                 # Log full error for debugging in development
                 logger.debug(f"Full error details: {e}")
-                await asyncio.sleep(5)
+                await asyncio.sleep(1)
     
     async def stop_processing(self):
         """Stop the message processing loop"""
         self.processing = False
         logger.info("Stopping message processor...")
+        
+        # Workers idle in get() would otherwise wait forever
+        for worker in self.workers:
+            worker.cancel()
+    
+    async def estimate_retry_after(self, error: QueueFullError) -> int:
+        """Seconds until a rejected message is likely to be accepted"""
+        if error.scope == "user":
+            # The user's own messages run one at a time
+            seconds = self.avg_processing_seconds
+        else:
+            # Time for the workers to drain the current backlog
+            seconds = await self.message_queue.asize() * self.avg_processing_seconds / self.num_workers
+        return max(1, math.ceil(seconds))
+    
+    def prefetch_research(self, user_id: str) -> bool:
+        """Research a newly connected user before their first greeting arrives.
+
+        The research is queued like a greeting, so it goes through queue
+        admission, the worker pool and research coalescing; a greeting sent
+        while it is queued or running gets its message_id.
+        """
+        if not self.speculative_research:
+            return False
+        profile = self.research_profiles.peek(user_id)
+        if profile is not None and not self.research_profiles.is_stale(profile):
+            return False
+        asyncio.create_task(self._queue_prefetch(user_id))
+        return True
+    
+    async def _queue_prefetch(self, user_id: str) -> None:
+        try:
+            message_id = await self.queue_user_message(user_id, RESEARCH_TRIGGER, message_type="system")
+        except QueueFullError as e:
+            # Research will run when the user asks for it
+            logger.info(f"Skipping speculative research for user {user_id}: {e}")
+            return
+        if message_id:
+            self.prefetches += 1
+            logger.info(f"Queued speculative research for user {user_id} as message {message_id}")
     
-    async def _process_message(self, message: Message):
-        """Process a single message"""
+    async def get_worker_stats(self) -> dict:
+        """Get per-worker statistics for the processor pool"""
+        workers = [dict(stats) for _, stats in sorted(self.worker_stats.items())]
+        return {
+            "num_workers": self.num_workers,
+            "busy_workers": sum(1 for stats in workers if stats["status"] == "busy"),
+            "avg_processing_seconds": self.avg_processing_seconds,
+            "processing_rate_per_second": self.num_workers / self.avg_processing_seconds if self.avg_processing_seconds else None,
+            "queue": await self.message_queue.aget_stats(),
+            "graph_cache": self._agent.get_cache_stats() if self._agent else None,
+            "models": self._agent.get_model_stats() if self._agent else None,
+            "compaction": compactor.get_stats(),
+            "token_usage": self._agent.get_usage_stats() if self._agent else None,
+            "tool_cache": tool_cache.get_stats(),
+            "tool_results": tool_results.get_stats(),
+            "streams": self.events.get_stats(),
+            "traces": self.traces.get_stats(),
+            "research": research_runs.get_stats(),
+            "research_profiles": self.research_profiles.get_stats(),
+            "speculative_research": {"enabled": self.speculative_research, "queued": self.prefetches},
+            "responses": self.message_responses.get_stats(),
+            "composio_executor": composio_executor.get_stats(),
+            "rate_limits": {
+                "openai": openai_limiter.get_stats(),
+                "composio": composio_limiter.get_stats(),
+            },
+            "storage": self.storage.get_stats(),
+            "workers": workers,
+        }
+    
+    async def _keep_leased(self, message_id: str):
+        """Renew the queue lease while a long agent run is in progress"""
+        while True:
+            await asyncio.sleep(self.lease_heartbeat)
+            await asyncio.to_thread(self.message_queue.extend_lease, message_id)
+    
+    async def _process_message(self, message: Message, waited: float = 0.0) -> bool:
+        """Process a single message, returning whether it succeeded"""
+        heartbeat = asyncio.create_task(self._keep_leased(message.message_id))
+        deadline = message_deadline.set(time.monotonic() + self.message_timeout)
+        trace = self.traces.start(message.message_id, message.user_id, waited)
+        trace_token = current_trace.set(trace)
+        outcome = "error"
         try:
             logger.info(f"Processing message {message.message_id} from user {message.user_id}")
+            self.events.publish(message.message_id, {"type": "started"})
+            # The user's previous message may have been answered by another
+            # process moments ago; start from the memory it saved
+            await asyncio.to_thread(self.memories.reload, message.user_id)
             
-            # Process through agent
-            response = await self.agent.process_message(message.user_id, message.content)
+            # Process through agent, streaming progress to any subscribers
+            response = await self.agent.process_message(
+                message.user_id,
+                message.content,
+                on_event=lambda event: self.events.publish(message.message_id, event),
+            )
             
             # Store the response mapped to message_id
             self.message_responses[message.message_id] = {
@@ -62,34 +256,90 @@ class MessageProcessor:
                 "status": "completed"
             }
             
-            # Store the conversation for history
-            self._add_conversation(message.user_id, message.content, "user")
-            self._add_conversation(message.user_id, response, "agent")
+            # Store the conversation for history; system messages (speculative
+            # research) are not part of it
+            if message.message_type != "system":
+                self._add_conversation(message.user_id, message.content, "user")
+                self._add_conversation(message.user_id, response, "agent")
+            # Storage writes behind; the response must be on disk before the
+            # ack deletes the message, or a crash in between loses both
+            await asyncio.to_thread(self.storage.flush)
+            await self.message_queue.aack(message.message_id)
+            self.events.publish(message.message_id, {"type": "completed", "response": response})
+            outcome = "completed"
             
             logger.info(f"Generated response for message {message.message_id}: {response[:100]}...")
+            return True
             
         except Exception as e:
             logger.error(f"Error processing message {message.message_id}: {type(e).__name__}")
-            # Store error response
-            self.message_responses[message.message_id] = {
-                "response": "Sorry, I encountered an error processing your message.",
-                "timestamp": __import__('datetime').datetime.now().isoformat(),
-                "status": "error"
-            }
             logger.debug(f"Full error details: {e}")
+            ERRORS.inc(stage="message", error_type=type(e).__name__)
+            
+            if await self.message_queue.anack(message.message_id, type(e).__name__):
+                logger.info(f"Message {message.message_id} will be retried")
+                self.events.publish(message.message_id, {"type": "retrying"})
+                outcome = "retrying"
+                return False
+            
+            # Out of attempts: the message is dead-lettered, store error response
+            self._store_error_response(message.message_id)
+            await asyncio.to_thread(self.storage.flush)
+            return False
+        finally:
+            heartbeat.cancel()
+            if outcome != "retrying":
+                research_runs.release(message.user_id, message.message_id)
+            message_deadline.reset(deadline)
+            trace.finish(outcome)
+            current_trace.reset(trace_token)
     
     
-    async def queue_user_message(self, user_id: str, content: str) -> str:
+    def _apply_remote_responses(self) -> None:
+        """Finish streams for messages another process answered"""
+        for message_id, entry in self.message_responses.apply_updates():
+            if entry.get("status") in TERMINAL_EVENTS:
+                self.events.publish(message_id, {"type": entry["status"], "response": entry["response"]})
+    
+    def _store_error_response(self, message_id: str) -> None:
+        self.message_responses[message_id] = {
+            "response": ERROR_RESPONSE,
+            "timestamp": __import__('datetime').datetime.now().isoformat(),
+            "status": "error"
+        }
+        self.events.publish(message_id, {"type": "error", "response": ERROR_RESPONSE})
+    
+    def _on_dead_letter(self, message_id: str, user_id: str, error: str) -> None:
+        """Answer a message the queue dead-lettered because its last lease expired"""
+        logger.error(f"Message {message_id} from user {user_id} was dead-lettered: {error}")
+        if self.message_responses.get(message_id, {}).get("status") == "processing":
+            self._store_error_response(message_id)
+        research_runs.release(user_id, message_id)
+    
+    async def queue_user_message(self, user_id: str, content: str, message_type: str = "user") -> str:
         """Queue a user message for processing and return message_id"""
         try:
             import uuid
+            research = is_research_trigger(content)
+            if research:
+                # Attach repeated research triggers to the one already queued
+                existing = research_runs.queued_message(
+                    user_id,
+                    lambda message_id: self.message_responses.get(message_id, {}).get("status") == "processing",
+                )
+                if existing:
+                    logger.info(f"Research already queued for user {user_id}, returning message {existing}")
+                    return existing
+            
             message_id = str(uuid.uuid4())
             
             message = Message(
                 user_id=user_id,
                 content=content,
-                message_type="user",
-                message_id=message_id
+                message_type=message_type,
+                message_id=message_id,
+                # Long research runs yield to short conversation turns
+                priority=PRIORITY_RESEARCH if research else PRIORITY_CONVERSATION,
             )
             
             # Mark as processing
@@ -98,33 +348,61 @@ class MessageProcessor:
                 "timestamp": __import__('datetime').datetime.now().isoformat(),
                 "status": "processing"
             }
+            # On disk before any process can lease the message, so every
+            # process knows the message_id and a quick answer is not overwritten
+            await asyncio.to_thread(self.storage.flush)
             
-            self.message_queue.appendleft(message)
+            try:
+                await self.message_queue.aput(message)
+            except QueueFullError as e:
+                del self.message_responses[message_id]
+                e.retry_after = await self.estimate_retry_after(e)
+                raise
+            if research:
+                research_runs.register(user_id, message_id)
             return message_id
             
+        except QueueFullError:
+            raise
         except Exception as e:
             logger.error(f"Error queuing message: {type(e).__name__}")
             logger.debug(f"Full error details: {e}")
             return ""
     
-    def get_message_response(self, message_id: str) -> dict:
-        """Get response for a specific message_id"""
-        return self.message_responses.get(message_id, {"status": "not_found"})
+    async def get_dead_letters(self) -> list:
+        """Get messages that failed on every attempt"""
+        return await self.message_queue.adead_letters()
+    
+    def get_message_trace(self, message_id: str) -> Optional[dict]:
+        """Get the execution timeline of a message, if it is still retained"""
+        return self.traces.get(message_id)
+    
+    async def get_message_response(self, message_id: str) -> dict:
+        """Get response for a specific message_id, with its queue position while waiting"""
+        response = self.message_responses.get(message_id, {"status": "not_found"})
+        if response.get("status") == "processing":
+            position = await self.message_queue.aposition(message_id)
+            if position is not None:
+                return {**response, "queue_position": position}
+        return response
     
     def _add_conversation(self, user_id: str, message: str, message_type: str) -> bool:
         """Add conversation to user memory"""
-        if user_id not in self.memories:
+        memory = self.memories.get(user_id)
+        if memory is None:
             from .models import UserMemory
-            self.memories[user_id] = UserMemory(user_id=user_id)
+            memory = UserMemory(user_id=user_id)
         
-        self.memories[user_id].conversation_history.append({
+        memory.conversation_history.append({
             "message": message,
             "type": message_type,
             "timestamp": __import__('datetime').datetime.now().isoformat()
         })
         
         # Keep only last 50 conversations
-        if len(self.memories[user_id].conversation_history) > 50:
-            self.memories[user_id].conversation_history = self.memories[user_id].conversation_history[-50:]
+        if len(memory.conversation_history) > 50:
+            memory.conversation_history = memory.conversation_history[-50:]
         
+        # Reassign so the change is persisted
+        self.memories[user_id] = memory
         return True
\ No newline at end of file
@@ -0,0 +1,634 @@
+import asyncio
+import heapq
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+# Priority classes: lower values are scheduled first
+PRIORITY_CONVERSATION = 0
+PRIORITY_RESEARCH = 1
+
+
+class QueueFullError(Exception):
+    """Raised when a message cannot be queued because the queue is at capacity.
+
+    ``scope`` is "global" when the whole queue is full and "user" when the
+    user has reached their own limit. ``retry_after`` is filled in by the
+    processor from the measured processing rate.
+    """
+
+    def __init__(self, message: str, scope: str = "global"):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after: Optional[int] = None
+
+
+def retry_backoff(attempts: int) -> float:
+    """Exponential backoff with full jitter before retrying a failed message"""
+    base = float(os.getenv("POKE_QUEUE_RETRY_BACKOFF", "2"))
+    return random.uniform(0, base * (2 ** (attempts - 1)))
+
+
+class MessageQueue:
+    """Bounded awaitable queue for user messages with fair scheduling.
+
+    Workers block on ``get()`` and are woken as soon as a message is put,
+    so there is no idle polling delay between enqueue and processing.
+
+    Each user's messages are handed out strictly in order and one at a time:
+    a user's next message only becomes available once the previous one is
+    acked or dead-lettered. Across users, the head message with the lowest
+    priority class goes first, and among equals the user served least
+    recently, so a heavy user cannot push everyone else back. A head message
+    that has waited ``priority_aging`` seconds competes in the top class, so
+    a steady stream of conversation turns cannot hold research back forever.
+
+    ``maxsize`` and ``max_per_user`` count every message not finished yet:
+    queued, in flight or waiting to retry. SQLiteMessageQueue counts the same.
+
+    Messages live only in this process; see SQLiteMessageQueue for a
+    durable queue that survives crashes and can be shared by processes.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        max_per_user: Optional[int] = None,
+        priority_aging: Optional[float] = None,
+    ):
+        self.maxsize = maxsize if maxsize is not None else int(os.getenv("POKE_QUEUE_MAX_SIZE", "1000"))
+        # Seconds after which a waiting message is promoted to the top priority class (0 disables)
+        self.priority_aging = priority_aging if priority_aging is not None else float(os.getenv("POKE_QUEUE_PRIORITY_AGING", "30"))
+        self.max_per_user = max_per_user or int(os.getenv("POKE_QUEUE_MAX_PER_USER", "5"))
+        self.max_attempts = max_attempts or int(os.getenv("POKE_QUEUE_MAX_ATTEMPTS", "3"))
+        self.max_dead_letters = int(os.getenv("POKE_QUEUE_MAX_DEAD_LETTERS", "1000"))
+        self._pending_by_user: Dict[str, int] = {}  # queued plus in-flight messages per user
+        self._pending = 0  # queued plus in-flight messages in total
+        self._user_queues: Dict[str, deque] = {}  # user_id -> deque of (enqueued_at, message, attempts)
+        self._busy_users: set = set()  # users with a message in flight or waiting to retry
+        self._ready_users: list = []  # heap of (priority, served_ticket, enqueued_at, user_id)
+        self._served: Dict[str, int] = {}  # user_id -> ticket of their last dispatch
+        self._next_ticket = 1
+        self._size = 0
+        self._available = asyncio.Event()
+        self._in_flight: Dict[str, Tuple[Message, int]] = {}  # message_id -> (message, attempts)
+        self._dead_letters: deque = deque(maxlen=self.max_dead_letters)
+        # Told about messages dead-lettered without a failed nack(), e.g. when
+        # their worker died on the last attempt; called as (message_id, user_id, error)
+        self.on_dead_letter: Optional[Callable[[str, str, str], None]] = None
+        self.total_enqueued = 0
+        self.total_dequeued = 0
+        self.total_retries = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.last_wait_seconds = 0.0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def depth(self) -> int:
+        """Messages waiting, without blocking (for metrics read on the event loop)"""
+        return self._size
+
+    def put_nowait(self, message: Message) -> None:
+        """Queue a message, raising QueueFullError when at capacity"""
+        if self._pending >= self.maxsize:
+            raise QueueFullError(f"Message queue is full ({self.maxsize} messages)")
+        if self._pending_by_user.get(message.user_id, 0) >= self.max_per_user:
+            raise QueueFullError(f"User has {self.max_per_user} messages pending", scope="user")
+        self._user_queues.setdefault(message.user_id, deque()).append((time.monotonic(), message, 0))
+        self._pending_by_user[message.user_id] = self._pending_by_user.get(message.user_id, 0) + 1
+        self._pending += 1
+        self._size += 1
+        self.total_enqueued += 1
+        self._schedule(message.user_id)
+
+    def _schedule(self, user_id: str) -> None:
+        """Make a user's head message available if they have nothing in flight"""
+        queue = self._user_queues.get(user_id)
+        if not queue or user_id in self._busy_users:
+            return
+        # While scheduled the user counts as busy, so they are in the heap once
+        self._busy_users.add(user_id)
+        enqueued_at, message, _ = queue[0]
+        heapq.heappush(self._ready_users, (message.priority, self._served.get(user_id, 0), enqueued_at, user_id))
+        self._available.set()
+
+    def _release(self, user_id: str) -> None:
+        self._busy_users.discard(user_id)
+        self._schedule(user_id)
+
+    def _finish(self, user_id: str) -> None:
+        """A user's in-flight message left the queue for good"""
+        self._pending -= 1
+        pending = self._pending_by_user.get(user_id, 0) - 1
+        if pending > 0:
+            self._pending_by_user[user_id] = pending
+        else:
+            self._pending_by_user.pop(user_id, None)
+        self._release(user_id)
+
+    def position(self, message_id: str) -> Optional[int]:
+        """Estimate a queued message's 1-based position, or None if not waiting.
+
+        Assumes round-robin across users: a message that is k-th in its user's
+        queue waits for up to k messages from every other user, plus one more
+        from users whose queue started earlier.
+        """
+        for user_id, queue in self._user_queues.items():
+            for index, (_, message, _) in enumerate(queue):
+                if message.message_id == message_id:
+                    head_enqueued_at = queue[0][0]
+                    ahead = index + sum(
+                        min(len(other), index + (1 if other[0][0] < head_enqueued_at else 0))
+                        for other_id, other in self._user_queues.items()
+                        if other_id != user_id
+                    )
+                    return ahead + 1
+        return None
+
+    def _promote_aged(self) -> None:
+        """Move head messages that have waited past priority_aging into the top class"""
+        if not self.priority_aging:
+            return
+        cutoff = time.monotonic() - self.priority_aging
+        promoted = False
+        for i, (priority, ticket, enqueued_at, user_id) in enumerate(self._ready_users):
+            if priority > PRIORITY_CONVERSATION and enqueued_at <= cutoff:
+                self._ready_users[i] = (PRIORITY_CONVERSATION, ticket, enqueued_at, user_id)
+                promoted = True
+        if promoted:
+            heapq.heapify(self._ready_users)
+
+    async def get(self) -> Tuple[Message, float]:
+        """Wait for the next message, returning it with its enqueue-to-start wait in seconds"""
+        while not self._ready_users:
+            self._available.clear()
+            await self._available.wait()
+
+        self._promote_aged()
+        _, _, _, user_id = heapq.heappop(self._ready_users)
+        queue = self._user_queues[user_id]
+        enqueued_at, message, attempts = queue.popleft()
+        if not queue:
+            del self._user_queues[user_id]
+        self._size -= 1
+        self._served[user_id] = self._next_ticket
+        self._next_ticket += 1
+
+        waited = time.monotonic() - enqueued_at
+        self._in_flight[message.message_id] = (message, attempts + 1)
+        self._record_wait(waited)
+        return message, waited
+
+    def _record_wait(self, waited: float) -> None:
+        self.total_dequeued += 1
+        self.total_wait_seconds += waited
+        self.last_wait_seconds = waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def ack(self, message_id: str) -> None:
+        """Mark a message as done once its response has been stored"""
+        entry = self._in_flight.pop(message_id, None)
+        if entry:
+            self._finish(entry[0].user_id)
+
+    def nack(self, message_id: str, error: str) -> bool:
+        """Report a failed attempt; returns True if the message will be retried"""
+        if message_id not in self._in_flight:
+            return False
+        message, attempts = self._in_flight.pop(message_id)
+        if attempts < self.max_attempts:
+            self.total_retries += 1
+            # The user stays busy during the backoff so their later messages wait
+            asyncio.get_running_loop().call_later(retry_backoff(attempts), self._retry, message, attempts)
+            return True
+        self._dead_letter(message, attempts, error)
+        self._finish(message.user_id)
+        return False
+
+    def _retry(self, message: Message, attempts: int) -> None:
+        # Back at the head of the user's queue to keep their messages in order
+        self._user_queues.setdefault(message.user_id, deque()).appendleft((time.monotonic(), message, attempts))
+        self._size += 1
+        self._release(message.user_id)
+
+    def _dead_letter(self, message: Message, attempts: int, error: str) -> None:
+        self._dead_letters.append({
+            "message_id": message.message_id,
+            "user_id": message.user_id,
+            "attempts": attempts,
+            "error": error,
+        })
+
+    def extend_lease(self, message_id: str) -> None:
+        """Keep a long-running message leased (nothing to do in-process)"""
+
+    # Coroutine versions of the queue operations for callers on the event
+    # loop. In-process they are plain dict work; SQLiteMessageQueue runs its
+    # blocking statements in a thread.
+    async def aput(self, message: Message) -> None:
+        self.put_nowait(message)
+
+    async def aack(self, message_id: str) -> None:
+        self.ack(message_id)
+
+    async def anack(self, message_id: str, error: str) -> bool:
+        return self.nack(message_id, error)
+
+    async def aposition(self, message_id: str) -> Optional[int]:
+        return self.position(message_id)
+
+    async def asize(self) -> int:
+        return len(self)
+
+    async def adead_letters(self) -> List[dict]:
+        return self.dead_letters()
+
+    async def aget_stats(self) -> dict:
+        return self.get_stats()
+
+    def dead_letters(self) -> List[dict]:
+        return list(self._dead_letters)
+
+    def close(self) -> None:
+        pass
+
+    def get_stats(self) -> dict:
+        """Get queue depth and enqueue-to-start latency statistics"""
+        return {
+            "backend": "memory",
+            "depth": len(self),
+            "in_flight": len(self._in_flight),
+            "users_waiting": len(self._user_queues),
+            "capacity": self.maxsize,
+            "max_per_user": self.max_per_user,
+            "total_enqueued": self.total_enqueued,
+            "total_dequeued": self.total_dequeued,
+            "total_retries": self.total_retries,
+            "dead_letters": len(self._dead_letters),
+            "avg_wait_seconds": self.total_wait_seconds / self.total_dequeued if self.total_dequeued else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "last_wait_seconds": self.last_wait_seconds,
+        }
+
+
+class SQLiteMessageQueue(MessageQueue):
+    """Durable message queue in SQLite with leases, acks and a dead-letter list.
+
+    ``get()`` leases a message for ``visibility_timeout`` seconds. A message
+    that is not acked before its lease expires (e.g. the process died) becomes
+    available again; failed attempts are retried with backoff until
+    ``max_attempts`` is reached, then the message is dead-lettered. Users are
+    scheduled with the same per-user ordering and fairness as MessageQueue.
+    Puts from this process wake local workers immediately; puts made through
+    another connection are seen within ``poll_interval`` seconds. Dead
+    letters are kept for ``dead_letter_ttl`` seconds, and at most
+    ``max_dead_letters`` of them.
+
+    Several server processes can share the database file: leases are taken
+    in one transaction, so each message goes to one worker, and a user's
+    next message is leased only after the previous one was acked, by which
+    time its response and memory are on disk (see StoredDict). Use the
+    ``a``-prefixed coroutine methods from the event loop; the plain ones
+    block on SQLite.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        maxsize: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        max_per_user: Optional[int] = None,
+        visibility_timeout: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+        priority_aging: Optional[float] = None,
+    ):
+        super().__init__(
+            maxsize=maxsize,
+            max_attempts=max_attempts,
+            max_per_user=max_per_user,
+            priority_aging=priority_aging,
+        )
+        self.path = path
+        self.visibility_timeout = visibility_timeout or float(os.getenv("POKE_QUEUE_VISIBILITY_TIMEOUT", "300"))
+        self.poll_interval = poll_interval or float(os.getenv("POKE_QUEUE_POLL_INTERVAL", "1"))
+        self.dead_letter_ttl = float(os.getenv("POKE_QUEUE_DEAD_LETTER_TTL", "604800"))
+        self._pruned_at = 0.0
+        self._depth = 0  # ready messages as of the last lease attempt
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS message_queue ("
+            " message_id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " state TEXT NOT NULL,"  # ready, leased or dead
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " enqueued_at REAL NOT NULL,"
+            " available_at REAL NOT NULL,"
+            " lease_expires_at REAL,"
+            " last_error TEXT,"
+            " priority INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(message_queue)")}
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE message_queue ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS message_queue_ready ON message_queue (state, available_at, enqueued_at)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS message_queue_user ON message_queue (user_id, state)")
+        # When each user was last served, for round-robin across users
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS message_queue_users (user_id TEXT PRIMARY KEY, served_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def __len__(self) -> int:
+        return self._execute("SELECT COUNT(*) FROM message_queue WHERE state = 'ready'")[0][0]
+
+    @property
+    def depth(self) -> int:
+        # Counted by every lease attempt, so it lags by at most poll_interval
+        return self._depth
+
+    def put_nowait(self, message: Message) -> None:
+        """Persist a message, raising QueueFullError when at capacity"""
+        self._insert(message)
+        self.total_enqueued += 1
+        self._wakeup.set()
+
+    async def aput(self, message: Message) -> None:
+        await asyncio.to_thread(self._insert, message)
+        self.total_enqueued += 1
+        self._wakeup.set()
+
+    def _insert(self, message: Message) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                pending = self._conn.execute(
+                    "SELECT COUNT(*) FROM message_queue WHERE state IN ('ready', 'leased')"
+                ).fetchone()[0]
+                if pending >= self.maxsize:
+                    raise QueueFullError(f"Message queue is full ({self.maxsize} messages)")
+                user_pending = self._conn.execute(
+                    "SELECT COUNT(*) FROM message_queue WHERE user_id = ? AND state IN ('ready', 'leased')",
+                    (message.user_id,),
+                ).fetchone()[0]
+                if user_pending >= self.max_per_user:
+                    raise QueueFullError(f"User has {self.max_per_user} messages pending", scope="user")
+                self._conn.execute(
+                    "INSERT INTO message_queue"
+                    " (message_id, user_id, payload, state, enqueued_at, available_at, priority)"
+                    " VALUES (?, ?, ?, 'ready', ?, ?, ?)",
+                    (message.message_id, message.user_id, message.model_dump_json(), now, now, message.priority),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def get(self) -> Tuple[Message, float]:
+        """Lease the next available message, waiting until one is ready"""
+        while True:
+            self._wakeup.clear()
+            leased, expired = await asyncio.to_thread(self._lease_next)
+            for message_id, user_id in expired:
+                self._report_dead_letter(message_id, user_id, "lease expired")
+            if leased:
+                message, enqueued_at = leased
+                waited = max(0.0, time.time() - enqueued_at)
+                self._record_wait(waited)
+                return message, waited
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _report_dead_letter(self, message_id: str, user_id: str, error: str) -> None:
+        if self.on_dead_letter is None:
+            return
+        try:
+            self.on_dead_letter(message_id, user_id, error)
+        except Exception as e:
+            logger.error(f"Error reporting dead-lettered message {message_id}: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+
+    def _lease_next(self) -> Tuple[Optional[Tuple[Message, float]], List[Tuple[str, str]]]:
+        """Lease the next eligible message, also returning (message_id, user_id) of leases dead-lettered on expiry"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._recover_expired_leases(now)
+                # Only a user's oldest pending message is eligible, so a user
+                # with a message leased or waiting to retry has none. Messages
+                # available for priority_aging seconds compete in the top class.
+                aged_before = now - self.priority_aging if self.priority_aging else float("-inf")
+                row = self._conn.execute(
+                    "SELECT q.message_id, q.payload, q.enqueued_at, q.user_id FROM message_queue q"
+                    " LEFT JOIN message_queue_users u ON u.user_id = q.user_id"
+                    " WHERE q.state = 'ready' AND q.available_at <= ?"
+                    " AND q.rowid = (SELECT MIN(rowid) FROM message_queue h"
+                    "                WHERE h.user_id = q.user_id AND h.state IN ('ready', 'leased'))"
+                    " ORDER BY CASE WHEN q.available_at <= ? THEN MIN(q.priority, ?) ELSE q.priority END,"
+                    " COALESCE(u.served_at, 0), q.rowid LIMIT 1",
+                    (now, aged_before, PRIORITY_CONVERSATION),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE message_queue SET state = 'leased', attempts = attempts + 1, lease_expires_at = ?"
+                        " WHERE message_id = ?",
+                        (now + self.visibility_timeout, row[0]),
+                    )
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO message_queue_users (user_id, served_at) VALUES (?, ?)",
+                        (row[3], now),
+                    )
+                self._depth = self._conn.execute("SELECT COUNT(*) FROM message_queue WHERE state = 'ready'").fetchone()[0]
+                if now - self._pruned_at >= 60:
+                    self._prune_dead_letters(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None, expired
+        return (Message.model_validate_json(row[1]), row[2]), expired
+
+    def _prune_dead_letters(self, now: float) -> None:
+        """Drop dead letters past dead_letter_ttl and all but the newest max_dead_letters"""
+        self._pruned_at = now
+        pruned = self._conn.execute(
+            "DELETE FROM message_queue WHERE state = 'dead' AND enqueued_at < ?", (now - self.dead_letter_ttl,)
+        ).rowcount
+        pruned += self._conn.execute(
+            "DELETE FROM message_queue WHERE state = 'dead' AND rowid NOT IN"
+            " (SELECT rowid FROM message_queue WHERE state = 'dead' ORDER BY enqueued_at DESC LIMIT ?)",
+            (self.max_dead_letters,),
+        ).rowcount
+        if pruned:
+            logger.info(f"Pruned {pruned} dead-lettered messages")
+
+    async def aposition(self, message_id: str) -> Optional[int]:
+        return await asyncio.to_thread(self.position, message_id)
+
+    async def asize(self) -> int:
+        return await asyncio.to_thread(len, self)
+
+    async def adead_letters(self) -> List[dict]:
+        return await asyncio.to_thread(self.dead_letters)
+
+    async def aget_stats(self) -> dict:
+        return await asyncio.to_thread(self.get_stats)
+
+    def position(self, message_id: str) -> Optional[int]:
+        """Estimate a queued message's 1-based position, or None if not waiting"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, rowid FROM message_queue WHERE message_id = ? AND state = 'ready'", (message_id,)
+            ).fetchone()
+            if not row:
+                return None
+            user_id, rowid = row
+            index, head = self._conn.execute(
+                "SELECT COUNT(*), MIN(rowid) FROM message_queue"
+                " WHERE user_id = ? AND state IN ('ready', 'leased') AND rowid <= ?",
+                (user_id, rowid),
+            ).fetchone()
+            others = self._conn.execute(
+                "SELECT COUNT(*), MIN(rowid) FROM message_queue WHERE state = 'ready' AND user_id != ? GROUP BY user_id",
+                (user_id,),
+            ).fetchall()
+        index -= 1  # the count includes the message itself
+        ahead = index + sum(min(count, index + (1 if other_head < head else 0)) for count, other_head in others)
+        return ahead + 1
+
+    def _recover_expired_leases(self, now: float) -> List[Tuple[str, str]]:
+        """Return messages whose worker died to the queue, or dead-letter them.
+
+        Returns (message_id, user_id) of the dead-lettered messages, which no
+        worker will report as failed.
+        """
+        expired = self._conn.execute(
+            "SELECT message_id, user_id FROM message_queue"
+            " WHERE state = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+            (now, self.max_attempts),
+        ).fetchall()
+        if expired:
+            self._conn.executemany(
+                "UPDATE message_queue SET state = 'dead', last_error = 'lease expired' WHERE message_id = ?",
+                [(message_id,) for message_id, _ in expired],
+            )
+        recovered = self._conn.execute(
+            "UPDATE message_queue SET state = 'ready', available_at = ?"
+            " WHERE state = 'leased' AND lease_expires_at < ?",
+            (now, now),
+        ).rowcount
+        if recovered:
+            logger.info(f"Recovered {recovered} messages with expired leases")
+        return expired
+
+    def ack(self, message_id: str) -> None:
+        self._execute("DELETE FROM message_queue WHERE message_id = ?", (message_id,))
+        # The user's next message may now be eligible
+        self._wakeup.set()
+
+    async def aack(self, message_id: str) -> None:
+        await asyncio.to_thread(self._execute, "DELETE FROM message_queue WHERE message_id = ?", (message_id,))
+        self._wakeup.set()
+
+    def nack(self, message_id: str, error: str) -> bool:
+        return self._schedule_retry(self._fail(message_id, error))
+
+    async def anack(self, message_id: str, error: str) -> bool:
+        return self._schedule_retry(await asyncio.to_thread(self._fail, message_id, error))
+
+    def _fail(self, message_id: str, error: str) -> Optional[float]:
+        """Record a failed attempt, returning the retry delay or None once the message is dead"""
+        rows = self._execute("SELECT attempts FROM message_queue WHERE message_id = ?", (message_id,))
+        attempts = rows[0][0] if rows else self.max_attempts
+        if attempts < self.max_attempts:
+            delay = retry_backoff(attempts)
+            self._execute(
+                "UPDATE message_queue SET state = 'ready', available_at = ?, lease_expires_at = NULL, last_error = ?"
+                " WHERE message_id = ?",
+                (time.time() + delay, error, message_id),
+            )
+            return delay
+        self._execute(
+            "UPDATE message_queue SET state = 'dead', last_error = ? WHERE message_id = ?",
+            (error, message_id),
+        )
+        return None
+
+    def _schedule_retry(self, delay: Optional[float]) -> bool:
+        if delay is None:
+            self._wakeup.set()
+            return False
+        self.total_retries += 1
+        asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+        return True
+
+    def extend_lease(self, message_id: str) -> None:
+        """Push back the lease expiry of a message that is still being processed"""
+        self._execute(
+            "UPDATE message_queue SET lease_expires_at = ? WHERE message_id = ? AND state = 'leased'",
+            (time.time() + self.visibility_timeout, message_id),
+        )
+
+    def dead_letters(self) -> List[dict]:
+        rows = self._execute(
+            "SELECT message_id, user_id, attempts, last_error FROM message_queue"
+            " WHERE state = 'dead' ORDER BY enqueued_at DESC LIMIT 100"
+        )
+        return [
+            {"message_id": message_id, "user_id": user_id, "attempts": attempts, "error": error}
+            for message_id, user_id, attempts, error in rows
+        ]
+
+    def get_stats(self) -> dict:
+        counts = dict(self._execute("SELECT state, COUNT(*) FROM message_queue GROUP BY state"))
+        users_waiting = self._execute("SELECT COUNT(DISTINCT user_id) FROM message_queue WHERE state = 'ready'")[0][0]
+        stats = super().get_stats()
+        stats.update({
+            "backend": "sqlite",
+            "depth": counts.get("ready", 0),
+            "in_flight": counts.get("leased", 0),
+            "users_waiting": users_waiting,
+            "dead_letters": counts.get("dead", 0),
+        })
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_message_queue() -> MessageQueue:
+    """Create the queue selected by POKE_QUEUE_BACKEND (sqlite or memory)"""
+    backend = os.getenv("POKE_QUEUE_BACKEND", "sqlite")
+    if backend == "memory":
+        return MessageQueue()
+    if backend == "sqlite":
+        return SQLiteMessageQueue(os.getenv("POKE_DB_PATH", "poke.db"))
+    raise ValueError(f"Unknown queue backend: {backend}")
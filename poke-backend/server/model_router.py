@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from .constants import DEFAULT_MODEL
+
+MODES = ("research", "conversation", "no_tools")
+
+
+class ModelHealth:
+    """Moving averages of one model's call latency and error rate"""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, seconds: float, error: bool) -> None:
+        self.calls += 1
+        self.errors += int(error)
+        self.error_rate += self.alpha * (float(error) - self.error_rate)
+        # Failed calls say little about how long a good answer takes
+        if not error:
+            self.latency = seconds if self.latency is None else self.latency + self.alpha * (seconds - self.latency)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+        }
+
+
+class ModelRouter:
+    """Picks the model for each agent mode.
+
+    Models come from POKE_MODEL_RESEARCH, POKE_MODEL_CONVERSATION and
+    POKE_MODEL_NO_TOOLS (default POKE_MODEL). When POKE_MODEL_FALLBACK is set,
+    a mode whose model averages slower than the mode's latency budget, or
+    fails more often than POKE_MODEL_MAX_ERROR_RATE, is routed to the
+    fallback; every ``probe_interval`` seconds one call still goes to the
+    primary so the router notices when it recovers.
+    """
+
+    def __init__(
+        self,
+        models: Optional[Dict[str, str]] = None,
+        fallback: Optional[str] = None,
+        latency_budgets: Optional[Dict[str, float]] = None,
+        max_error_rate: Optional[float] = None,
+        probe_interval: Optional[float] = None,
+        alpha: Optional[float] = None,
+    ):
+        self.models = models or {
+            mode: os.getenv(f"POKE_MODEL_{mode.upper()}") or DEFAULT_MODEL for mode in MODES
+        }
+        self.fallback = fallback if fallback is not None else os.getenv("POKE_MODEL_FALLBACK") or None
+        self.latency_budgets = latency_budgets or {
+            "research": float(os.getenv("POKE_MODEL_LATENCY_BUDGET_RESEARCH", "60")),
+            "conversation": float(os.getenv("POKE_MODEL_LATENCY_BUDGET_CONVERSATION", "15")),
+            "no_tools": float(os.getenv("POKE_MODEL_LATENCY_BUDGET_NO_TOOLS", "15")),
+        }
+        self.max_error_rate = max_error_rate if max_error_rate is not None else float(os.getenv("POKE_MODEL_MAX_ERROR_RATE", "0.5"))
+        self.probe_interval = probe_interval if probe_interval is not None else float(os.getenv("POKE_MODEL_PROBE_INTERVAL", "30"))
+        self.alpha = alpha or float(os.getenv("POKE_MODEL_EWMA_ALPHA", "0.2"))
+        self._health: Dict[str, ModelHealth] = {}
+        self._last_probe: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.fallbacks: Dict[str, int] = {mode: 0 for mode in MODES}
+
+    def _get_health(self, model: str) -> ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = ModelHealth(self.alpha)
+        return health
+
+    def is_degraded(self, model: str, mode: str) -> bool:
+        health = self._health.get(model)
+        if health is None:
+            return False
+        too_slow = health.latency is not None and health.latency > self.latency_budgets.get(mode, float("inf"))
+        return too_slow or health.error_rate > self.max_error_rate
+
+    def choose(self, mode: str) -> str:
+        """The model to call for ``mode`` right now"""
+        primary = self.models.get(mode, DEFAULT_MODEL)
+        if not self.fallback or self.fallback == primary:
+            return primary
+        with self._lock:
+            if not self.is_degraded(primary, mode):
+                self._last_probe.pop(primary, None)
+                return primary
+            now = time.monotonic()
+            if now - self._last_probe.setdefault(primary, now) >= self.probe_interval:
+                self._last_probe[primary] = now
+                return primary
+            self.fallbacks[mode] += 1
+            return self.fallback
+
+    def fallback_for(self, model: str) -> Optional[str]:
+        """The model to retry a failed call on, if there is one"""
+        return self.fallback if self.fallback and self.fallback != model else None
+
+    def record(self, model: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self._get_health(model).record(seconds, error)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "models": dict(self.models),
+                "fallback": self.fallback,
+                "latency_budget_seconds": dict(self.latency_budgets),
+                "fallbacks": dict(self.fallbacks),
+                "health": {model: health.to_dict() for model, health in self._health.items()},
+            }
@@ -14,8 +14,25 @@ class Message(BaseModel):
     message_type: str  # "user", "agent", "system"
     timestamp: datetime = datetime.now()
     message_id: str = ""
+    priority: int = 0  # scheduling class, lower runs first
+
+
+class ResearchProfile(BaseModel):
+    response: str  # the research greeting shown to the user
+    # Findings about the user, filled in after the research run
+    name: Optional[str] = None
+    email: Optional[str] = None
+    company: Optional[str] = None
+    role: Optional[str] = None
+    location: Optional[str] = None
+    summary: Optional[str] = None
+    highlights: list = []
+    sources: list = []  # URLs the research drew on
+    tools_used: list = []  # tools called while researching
+    researched_at: datetime
 
 
 class UserMemory(BaseModel):
     user_id: str
-    conversation_history: list = []
\ No newline at end of file
+    conversation_history: list = []
+    research_profile: Optional[ResearchProfile] = None
\ No newline at end of file
@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Monotonic time by which the current message should be answered; retries and
+# throttling waits that would run past it fail fast instead
+message_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("message_deadline", default=None)
+
+
+class RateLimitTimeout(Exception):
+    """Raised when waiting for capacity would exceed the message's time budget"""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether an upstream error means we are being rate limited"""
+    # Our own budget running out is not a provider 429; treating it as one
+    # would halve the concurrency limit and retry a call with no time left
+    if isinstance(error, RateLimitTimeout):
+        return False
+    # openai and composio_client both raise RateLimitError(APIStatusError) with status 429
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether an idempotent upstream call is worth retrying"""
+    if isinstance(error, RateLimitTimeout):
+        return False
+    if is_rate_limit_error(error):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code >= 500
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.throttled_seconds = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1, deadline: Optional[float] = None) -> None:
+        """Take ``amount`` tokens, waiting for the bucket to refill if needed"""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            wait = (amount - self.tokens) / self.rate
+            remaining = _remaining(deadline)
+            if remaining is not None and wait > remaining:
+                raise RateLimitTimeout(f"Rate limit wait of {wait:.1f}s exceeds the time budget")
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """Charge (or refund) tokens after the fact, e.g. actual vs. estimated usage"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit: halves whenever the upstream rate limits us and
+    grows back by about one per window of successful calls, up to ``maximum``."""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: Optional[int] = None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.in_flight = 0
+        self.decreases = 0
+        self._changed = asyncio.Event()
+
+    async def acquire(self, deadline: Optional[float] = None) -> None:
+        while self.in_flight >= int(self.limit):
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), _remaining(deadline))
+            except asyncio.TimeoutError:
+                raise RateLimitTimeout("Waiting for a concurrency slot exceeds the time budget")
+        self.in_flight += 1
+
+    def release(self, rate_limited: bool = False) -> None:
+        self.in_flight -= 1
+        if rate_limited:
+            self.limit = max(self.minimum, self.limit / 2)
+            self.decreases += 1
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._changed.set()
+
+
+class UpstreamLimiter:
+    """Client-side limits for one upstream provider.
+
+    Combines a request bucket, an optional token bucket and an adaptive
+    concurrency limit, and retries failures accepted by ``retryable`` with
+    full-jitter exponential backoff as long as the message's time budget
+    allows.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        max_concurrency: int,
+        tokens_per_minute: Optional[float] = None,
+        retryable: Callable[[Exception], bool] = is_rate_limit_error,
+        max_attempts: Optional[int] = None,
+        base_backoff: Optional[float] = None,
+        max_backoff: float = 30.0,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrency)
+        self.retryable = retryable
+        self.max_attempts = max_attempts or int(os.getenv("POKE_UPSTREAM_MAX_ATTEMPTS", "4"))
+        self.base_backoff = base_backoff or float(os.getenv("POKE_UPSTREAM_RETRY_BACKOFF", "1"))
+        self.max_backoff = max_backoff
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    async def call(self, fn: Callable[[], Awaitable], tokens: float = 0):
+        """Await ``fn()`` within the limits, retrying transient failures"""
+        deadline = message_deadline.get()
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.requests.acquire(1, deadline)
+            if self.tokens and tokens:
+                await self.tokens.acquire(tokens, deadline)
+            await self.concurrency.acquire(deadline)
+
+            rate_limited = False
+            try:
+                self.calls += 1
+                return await fn()
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                if rate_limited:
+                    self.rate_limited += 1
+                if not self.retryable(e) or attempt >= self.max_attempts:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1)))
+                remaining = _remaining(deadline)
+                if remaining is not None and delay > remaining:
+                    raise
+                logger.info(f"{self.name} call failed with {type(e).__name__}, retrying in {delay:.1f}s")
+                self.retries += 1
+            finally:
+                self.concurrency.release(rate_limited)
+            await asyncio.sleep(delay)
+
+    def record_tokens(self, amount: float) -> None:
+        """Correct the token bucket once actual usage is known"""
+        if self.tokens:
+            self.tokens.adjust(amount)
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "concurrency_decreases": self.concurrency.decreases,
+            "request_tokens_available": round(self.requests.tokens, 2),
+            "model_tokens_available": round(self.tokens.tokens) if self.tokens else None,
+            "throttled_seconds": round(
+                self.requests.throttled_seconds + (self.tokens.throttled_seconds if self.tokens else 0), 3
+            ),
+        }
+
+
+def estimate_tokens(messages) -> int:
+    """Rough prompt size (about four characters per token) for the token bucket"""
+    return sum(len(str(getattr(message, "content", message))) for message in messages) // 4 + 1
+
+
+# Model calls are idempotent, so transient errors are retried too
+openai_limiter = UpstreamLimiter(
+    "openai",
+    requests_per_minute=float(os.getenv("POKE_OPENAI_RPM", "500")),
+    tokens_per_minute=float(os.getenv("POKE_OPENAI_TPM", "200000")),
+    max_concurrency=int(os.getenv("POKE_OPENAI_MAX_CONCURRENCY", "16")),
+    retryable=is_transient_error,
+)
+
+# Composio calls may have side effects, so only rejected (rate limited) calls are retried
+composio_limiter = UpstreamLimiter(
+    "composio",
+    requests_per_minute=float(os.getenv("POKE_COMPOSIO_RPM", "600")),
+    max_concurrency=int(os.getenv("POKE_COMPOSIO_MAX_CONCURRENCY", "16")),
+    retryable=is_rate_limit_error,
+)
@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional
+
+from .models import ResearchProfile, UserMemory
+
+logger = logging.getLogger(__name__)
+
+# Findings the extraction prompt asks the model for
+FINDING_FIELDS = ("name", "company", "role", "location", "summary")
+MAX_HIGHLIGHTS = 10
+MAX_SOURCES = 10
+
+
+def find_values(value: Any, keys: tuple) -> Iterator[Any]:
+    """Every value stored under one of ``keys`` anywhere in parsed JSON"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in keys:
+                yield item
+            yield from find_values(item, keys)
+    elif isinstance(value, list):
+        for item in value:
+            yield from find_values(item, keys)
+
+
+def collect_sources(tool_outputs: Iterable[str]) -> List[str]:
+    """URLs in the JSON outputs of search tools, in order of first appearance"""
+    sources: List[str] = []
+    for output in tool_outputs:
+        try:
+            data = json.loads(output)
+        except ValueError:
+            continue
+        for url in find_values(data, ("url", "link")):
+            if isinstance(url, str) and url.startswith("http") and url not in sources:
+                sources.append(url)
+    return sources[:MAX_SOURCES]
+
+
+def profile_email(tool_outputs: Iterable[str]) -> Optional[str]:
+    """The user's address from a GMAIL_GET_PROFILE output"""
+    for output in tool_outputs:
+        try:
+            data = json.loads(output)
+        except ValueError:
+            continue
+        for email in find_values(data, ("emailAddress",)):
+            if isinstance(email, str) and email:
+                return email
+    return None
+
+
+def parse_findings(text: str) -> dict:
+    """Profile fields from the extraction model's JSON reply; unknown or malformed fields are dropped"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    findings = {
+        field: str(data[field]).strip()
+        for field in FINDING_FIELDS
+        if isinstance(data.get(field), (str, int, float)) and str(data[field]).strip()
+    }
+    highlights = data.get("highlights")
+    if isinstance(highlights, list):
+        findings["highlights"] = [str(item).strip() for item in highlights if item][:MAX_HIGHLIGHTS]
+    return findings
+
+
+def format_profile(profile: ResearchProfile) -> str:
+    """What research found about the user, as context for conversation mode"""
+    lines = [
+        f"{label}: {value}"
+        for label, value in (
+            ("Name", profile.name),
+            ("Email", profile.email),
+            ("Company", profile.company),
+            ("Role", profile.role),
+            ("Location", profile.location),
+            ("Summary", profile.summary),
+        )
+        if value
+    ]
+    lines += [f"- {highlight}" for highlight in profile.highlights]
+    if not any((profile.name, profile.company, profile.role, profile.summary, profile.highlights)):
+        # Findings not extracted (yet); the greeting is the best summary we have
+        lines.append(f"Research summary: {profile.response}")
+    if profile.sources:
+        lines.append("Sources: " + ", ".join(profile.sources))
+    return "What your research found about this user:\n" + "\n".join(lines)
+
+
+class ResearchCoordinator:
+    """Single-flight initial research per user.
+
+    Research is the most expensive run we have and the frontend easily
+    triggers it more than once during onboarding (polling, page reloads).
+    While a user's research is in flight, later triggers attach to it:
+    ``queued_message`` hands back the message already queued for it, and
+    ``run`` shares one agent run between concurrent callers.
+    """
+
+    def __init__(self):
+        self._runs: Dict[str, asyncio.Task] = {}
+        self._listeners: Dict[str, List[Callable[[dict], None]]] = {}
+        self._messages: Dict[str, str] = {}  # user_id -> queued research message_id
+        self.started = 0
+        self.coalesced_runs = 0
+        self.coalesced_messages = 0
+
+    async def run(
+        self,
+        user_id: str,
+        fn: Callable[[Callable[[dict], None]], Awaitable[str]],
+        on_event: Optional[Callable[[dict], None]] = None,
+    ) -> str:
+        """Run ``fn`` unless research for ``user_id`` is already running, then share its result.
+
+        ``fn`` gets an event callback that forwards progress to every attached caller.
+        """
+        listeners = self._listeners.setdefault(user_id, [])
+        if on_event is not None:
+            listeners.append(on_event)
+
+        task = self._runs.get(user_id)
+        if task is None:
+            self.started += 1
+            task = asyncio.create_task(fn(lambda event: self._publish(user_id, event)))
+            self._runs[user_id] = task
+            task.add_done_callback(lambda _: self._finish(user_id, task))
+        else:
+            self.coalesced_runs += 1
+            logger.info(f"Research for user {user_id} already running, attaching to it")
+
+        try:
+            # Shielded so one caller giving up does not cancel the run for the others
+            return await asyncio.shield(task)
+        finally:
+            if on_event is not None and on_event in self._listeners.get(user_id, ()):
+                self._listeners[user_id].remove(on_event)
+
+    def _publish(self, user_id: str, event: dict) -> None:
+        for listener in list(self._listeners.get(user_id, ())):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.debug(f"Research event listener failed: {e}")
+
+    def _finish(self, user_id: str, task: asyncio.Task) -> None:
+        if self._runs.get(user_id) is task:
+            del self._runs[user_id]
+            self._listeners.pop(user_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Research for user {user_id} failed: {task.exception()}")
+
+    def queued_message(self, user_id: str, is_pending: Callable[[str], bool]) -> Optional[str]:
+        """The research message already queued or running for this user, if any"""
+        message_id = self._messages.get(user_id)
+        if message_id is None:
+            return None
+        if not is_pending(message_id):
+            # Finished or dropped without going through release()
+            del self._messages[user_id]
+            return None
+        self.coalesced_messages += 1
+        return message_id
+
+    def register(self, user_id: str, message_id: str) -> None:
+        self._messages[user_id] = message_id
+
+    def release(self, user_id: str, message_id: str) -> None:
+        if self._messages.get(user_id) == message_id:
+            del self._messages[user_id]
+
+    def get_stats(self) -> dict:
+        return {
+            "in_flight": len(self._runs),
+            "queued": len(self._messages),
+            "started": self.started,
+            "coalesced_runs": self.coalesced_runs,
+            "coalesced_messages": self.coalesced_messages,
+        }
+
+
+class ResearchProfiles:
+    """Research results kept on ``UserMemory`` and reused for later greetings.
+
+    A profile older than the TTL is still served, and refreshed in the
+    background so the next greeting gets the new one. Structured
+    findings (name, company, role, ...) are extracted from the greeting in
+    the background once it is saved, so they never delay it.
+    """
+
+    def __init__(self, memories: MutableMapping[str, UserMemory], ttl: Optional[float] = None):
+        self.memories = memories
+        self.ttl = ttl if ttl is not None else float(os.getenv("POKE_RESEARCH_PROFILE_TTL", "604800"))
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._extracting: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.extractions = 0
+        self.extraction_errors = 0
+
+    def get(self, user_id: str) -> Optional[ResearchProfile]:
+        memory = self.memories.get(user_id)
+        profile = memory.research_profile if memory is not None else None
+        if profile is None:
+            self.misses += 1
+        elif self.is_stale(profile):
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return profile
+
+    def peek(self, user_id: str) -> Optional[ResearchProfile]:
+        """The stored profile, without counting it as a greeting lookup"""
+        memory = self.memories.get(user_id)
+        return memory.research_profile if memory is not None else None
+
+    def is_stale(self, profile: ResearchProfile) -> bool:
+        return (datetime.now() - profile.researched_at).total_seconds() > self.ttl
+
+    def save(
+        self,
+        user_id: str,
+        response: str,
+        tools_used: List[str],
+        sources: Optional[List[str]] = None,
+        email: Optional[str] = None,
+    ) -> ResearchProfile:
+        memory = self.memories.get(user_id)
+        if memory is None:
+            memory = UserMemory(user_id=user_id)
+        memory.research_profile = ResearchProfile(
+            response=response,
+            email=email,
+            sources=sources or [],
+            tools_used=tools_used,
+            researched_at=datetime.now(),
+        )
+        # Reassign so the change is persisted
+        self.memories[user_id] = memory
+        return memory.research_profile
+
+    def extract(self, user_id: str, profile: ResearchProfile, fn: Callable[[], Awaitable[dict]]) -> None:
+        """Fill in ``profile``'s findings from ``fn`` in the background"""
+        self.extractions += 1
+        task = asyncio.create_task(self._extract(user_id, profile, fn), context=contextvars.Context())
+        self._extracting[user_id] = task
+
+    async def _extract(self, user_id: str, profile: ResearchProfile, fn: Callable[[], Awaitable[dict]]) -> None:
+        try:
+            findings = await fn()
+        except Exception as e:
+            self.extraction_errors += 1
+            logger.error(f"Error extracting research findings for user {user_id}: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+            return
+        finally:
+            if self._extracting.get(user_id) is asyncio.current_task():
+                del self._extracting[user_id]
+        memory = self.memories.get(user_id)
+        # Research may have been redone while we were extracting
+        if not findings or memory is None or memory.research_profile is None \
+                or memory.research_profile.researched_at != profile.researched_at:
+            return
+        memory.research_profile = memory.research_profile.model_copy(update=findings)
+        self.memories[user_id] = memory
+
+    def refresh(self, user_id: str, fn: Callable[[], Awaitable[str]]) -> None:
+        """Re-run research for the user in the background, once at a time"""
+        if user_id in self._refreshing:
+            return
+        self.refreshes += 1
+        self._start(user_id, fn)
+
+    def _start(self, user_id: str, fn: Callable[[], Awaitable[str]]) -> None:
+        # A fresh context keeps the refresh out of the current message's trace and time budget
+        task = asyncio.create_task(fn(), context=contextvars.Context())
+        self._refreshing[user_id] = task
+        task.add_done_callback(lambda _: self._refreshed(user_id, task))
+
+    def _refreshed(self, user_id: str, task: asyncio.Task) -> None:
+        self._refreshing.pop(user_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            logger.error(f"Error refreshing research for user {user_id}: {type(task.exception()).__name__}")
+            logger.debug(f"Full error details: {task.exception()}")
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "extracting": len(self._extracting),
+            "extractions": self.extractions,
+            "extraction_errors": self.extraction_errors,
+        }
+
+
+research_runs = ResearchCoordinator()
@@ -0,0 +1,235 @@
+import heapq
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .storage import Storage
+
+# Rough per-entry overhead for the dict, timestamp and bookkeeping
+ENTRY_OVERHEAD_BYTES = 400
+
+ERROR_RESPONSE = "Sorry, I encountered an error processing your message."
+
+
+class ResponseStore:
+    """Bounded store of message responses keyed by message_id.
+
+    Completed and errored entries expire after their own TTLs, and once the
+    store holds ``max_size`` entries the least recently used finished entry is
+    evicted. Entries still processing are never evicted; one still processing
+    after ``processing_ttl`` (its message was lost, e.g. in a crash) becomes an
+    error so clients stop waiting for it.
+
+    With a ``storage`` backend, entries are also persisted so they survive
+    restarts and in-memory LRU eviction until their TTL passes. Entries
+    another process writes (e.g. it answered a message queued here) arrive
+    through the storage watch and are applied by ``apply_updates``, which
+    ``get`` calls; ``on_change`` is called from the storage thread when
+    updates are waiting.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        completed_ttl: Optional[float] = None,
+        error_ttl: Optional[float] = None,
+        processing_ttl: Optional[float] = None,
+        storage: Optional[Storage] = None,
+    ):
+        self.max_size = max_size or int(os.getenv("POKE_RESPONSE_STORE_MAX_SIZE", "10000"))
+        self.ttls = {
+            "completed": completed_ttl if completed_ttl is not None else float(os.getenv("POKE_RESPONSE_TTL", "3600")),
+            "error": error_ttl if error_ttl is not None else float(os.getenv("POKE_ERROR_RESPONSE_TTL", "600")),
+            # Longer than every attempt of a message plus its queue wait
+            "processing": processing_ttl if processing_ttl is not None else float(os.getenv("POKE_PROCESSING_TTL", "3600")),
+        }
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._expiry_heap: list = []  # (expires_at, message_id)
+        self._expires_at: Dict[str, float] = {}
+        self.total_bytes = 0
+        self.ttl_evictions = 0
+        self.lru_evictions = 0
+        self.processing_expired = 0
+        self.remote_updates = 0
+        self._updates: Dict[str, Optional[dict]] = {}
+        self._updates_lock = threading.Lock()
+        self.on_change: Optional[Callable[[], None]] = None
+        self.storage = storage or Storage()
+        self.storage.prune("responses", max(self.ttls.values()))
+        self.storage.watch("responses", self._on_change)
+
+    def __len__(self) -> int:
+        self._purge_expired()
+        return len(self._entries)
+
+    def __contains__(self, message_id: str) -> bool:
+        return self.get(message_id) is not None
+
+    def __getitem__(self, message_id: str) -> dict:
+        entry = self.get(message_id)
+        if entry is None:
+            raise KeyError(message_id)
+        return entry
+
+    def __setitem__(self, message_id: str, entry: dict) -> None:
+        ttl = self.ttls.get(entry.get("status"))
+        self.storage.save("responses", message_id, entry)
+        self._insert(message_id, entry, ttl)
+
+    def _insert(self, message_id: str, entry: dict, ttl: Optional[float]) -> None:
+        self._remove(message_id)
+        self._entries[message_id] = entry
+        self._sizes[message_id] = self._entry_size(entry)
+        self.total_bytes += self._sizes[message_id]
+
+        if ttl is not None:
+            expires_at = time.monotonic() + ttl
+            self._expires_at[message_id] = expires_at
+            heapq.heappush(self._expiry_heap, (expires_at, message_id))
+
+        self._purge_expired()
+        self._evict_lru()
+
+    def __delitem__(self, message_id: str) -> None:
+        if message_id not in self._entries:
+            raise KeyError(message_id)
+        self._remove(message_id)
+        self.storage.delete("responses", message_id)
+
+    def get(self, message_id: str, default=None):
+        """Get an entry, marking it as recently used"""
+        self.apply_updates()
+        self._purge_expired()
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return self._load(message_id, default)
+        self._entries.move_to_end(message_id)
+        return entry
+
+    def _on_change(self, changes: Dict[str, Optional[dict]]) -> None:
+        # Runs on the storage thread; applied on the caller's thread
+        with self._updates_lock:
+            self._updates.update(changes)
+        if self.on_change is not None:
+            self.on_change()
+
+    def apply_updates(self) -> List[Tuple[str, dict]]:
+        """Apply entries written by other processes, returning the (message_id, entry) pairs applied"""
+        with self._updates_lock:
+            if not self._updates:
+                return []
+            updates, self._updates = self._updates, {}
+        applied = []
+        for message_id, entry in updates.items():
+            # Anything not held here is read through on demand
+            if message_id not in self._entries:
+                continue
+            if entry is None:
+                self._remove(message_id)
+                continue
+            entry = self._restore(message_id, entry)
+            if entry is not None:
+                self.remote_updates += 1
+                applied.append((message_id, entry))
+        return applied
+
+    def _load(self, message_id: str, default=None):
+        """Read through to storage for entries evicted from memory or from before a restart"""
+        entry = self.storage.load("responses", message_id)
+        if entry is None:
+            return default
+        entry = self._restore(message_id, entry)
+        return entry if entry is not None else default
+
+    def _restore(self, message_id: str, entry: dict) -> Optional[dict]:
+        """Insert a stored entry with the TTL it has left, or None if it has expired"""
+        ttl = self.ttls.get(entry.get("status"))
+        if ttl is None:
+            self._insert(message_id, entry, None)
+            return entry
+
+        age = (datetime.now() - datetime.fromisoformat(entry["timestamp"])).total_seconds()
+        if age >= ttl:
+            if entry.get("status") == "processing":
+                return self._expire_processing(message_id)
+            self._remove(message_id)
+            self.storage.delete("responses", message_id)
+            return None
+
+        self._insert(message_id, entry, ttl - age)
+        return entry
+
+    def _remove(self, message_id: str) -> None:
+        if message_id in self._entries:
+            del self._entries[message_id]
+            self.total_bytes -= self._sizes.pop(message_id)
+            # Stale heap items are skipped when popped
+            self._expires_at.pop(message_id, None)
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        lost = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, message_id = heapq.heappop(self._expiry_heap)
+            if self._expires_at.get(message_id) == expires_at:
+                if self._entries[message_id].get("status") == "processing":
+                    lost.append(message_id)
+                    continue
+                self._remove(message_id)
+                self.storage.delete("responses", message_id)
+                self.ttl_evictions += 1
+        for message_id in lost:
+            self._expire_processing(message_id)
+
+    def _expire_processing(self, message_id: str) -> dict:
+        """Turn an entry that outlived processing_ttl into an error response"""
+        entry = {
+            "response": ERROR_RESPONSE,
+            "timestamp": datetime.now().isoformat(),
+            "status": "error",
+        }
+        self.processing_expired += 1
+        self[message_id] = entry
+        return entry
+
+    def _evict_lru(self) -> None:
+        excess = len(self._entries) - self.max_size
+        if excess <= 0:
+            return
+        victims = []
+        for message_id, entry in self._entries.items():
+            if len(victims) >= excess:
+                break
+            if entry.get("status") != "processing":
+                victims.append(message_id)
+        for message_id in victims:
+            self._remove(message_id)
+            self.lru_evictions += 1
+
+    @staticmethod
+    def _entry_size(entry: dict) -> int:
+        response = entry.get("response") or ""
+        return ENTRY_OVERHEAD_BYTES + sys.getsizeof(response)
+
+    def get_stats(self) -> dict:
+        """Get entry counts, approximate memory usage and eviction counters"""
+        by_status: Dict[str, int] = {}
+        for entry in self._entries.values():
+            status = entry.get("status", "unknown")
+            by_status[status] = by_status.get(status, 0) + 1
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "by_status": by_status,
+            "approx_bytes": self.total_bytes,
+            "ttl_seconds": dict(self.ttls),
+            "ttl_evictions": self.ttl_evictions,
+            "lru_evictions": self.lru_evictions,
+            "processing_expired": self.processing_expired,
+            "remote_updates": self.remote_updates,
+        }
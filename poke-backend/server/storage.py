@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, List, Optional, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Called with {key: value, or None if deleted} for keys another process changed
+ChangeCallback = Callable[[Dict[str, Optional[dict]]], None]
+
+
+class Storage:
+    """Namespaced key/value persistence for users, memories and responses.
+
+    Values are JSON-serializable dicts. The base class persists nothing, which
+    is the behaviour of the original in-process dicts.
+    """
+
+    def load(self, namespace: str, key: str) -> Optional[dict]:
+        return None
+
+    def keys(self, namespace: str) -> List[str]:
+        return []
+
+    def save(self, namespace: str, key: str, value: dict) -> None:
+        pass
+
+    def delete(self, namespace: str, key: str) -> None:
+        pass
+
+    def prune(self, namespace: str, max_age: float) -> int:
+        """Delete entries not written for ``max_age`` seconds, returning how many"""
+        return 0
+
+    def flush(self) -> None:
+        """Make every change saved so far durable"""
+
+    def watch(self, namespace: str, callback: ChangeCallback) -> None:
+        """Have ``callback`` told about changes other processes make to ``namespace``"""
+
+    def get_stats(self) -> dict:
+        return {"backend": "memory"}
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteStorage(Storage):
+    """Embedded SQLite storage with batched write-behind.
+
+    ``save`` and ``delete`` only record the change in memory; a background
+    thread writes pending changes in one transaction every ``flush_interval``
+    seconds, so request handlers never wait on disk. Reads see pending
+    changes before they are flushed. Call ``flush`` before doing anything
+    that relies on a change having reached disk.
+
+    Several processes can share the database file. Every write gets a new
+    version from a shared counter (deletes are kept as ``null`` tombstones),
+    and after each flush the same thread reads the rows written by other
+    processes since the last look and passes them to the ``watch`` callbacks
+    of their namespace, so in-memory caches follow without extra reads.
+    """
+
+    def __init__(self, path: str, flush_interval: Optional[float] = None):
+        self.path = path
+        self.flush_interval = flush_interval or float(os.getenv("POKE_STORAGE_FLUSH_INTERVAL", "0.5"))
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(kv)")}
+        if "version" not in columns:
+            self._conn.execute("ALTER TABLE kv ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_changes ON kv (version)")
+        # Kept apart from kv so pruning rows never hands out a version twice
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO kv_version (id, version) VALUES (0, 0)")
+        self._conn.commit()
+        self._seen_version = self._conn.execute("SELECT version FROM kv_version").fetchone()[0]
+        self._own_versions: set = set()  # versions this process wrote and has not polled past yet
+        self._watchers: Dict[str, List[ChangeCallback]] = {}
+        self._db_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[tuple, Optional[str]] = {}  # (namespace, key) -> JSON, None to delete
+        self.flushes = 0
+        self.rows_written = 0
+        self.remote_changes = 0
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="storage-flush", daemon=True)
+        self._flusher.start()
+
+    def load(self, namespace: str, key: str) -> Optional[dict]:
+        with self._pending_lock:
+            if (namespace, key) in self._pending:
+                value = self._pending[(namespace, key)]
+                return json.loads(value) if value is not None else None
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def keys(self, namespace: str) -> List[str]:
+        with self._db_lock:
+            keys = {
+                row[0]
+                for row in self._conn.execute("SELECT key FROM kv WHERE namespace = ? AND value != 'null'", (namespace,))
+            }
+        with self._pending_lock:
+            for (pending_namespace, key), value in self._pending.items():
+                if pending_namespace != namespace:
+                    continue
+                if value is None:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return list(keys)
+
+    def save(self, namespace: str, key: str, value: dict) -> None:
+        serialized = json.dumps(value)
+        with self._pending_lock:
+            self._pending[(namespace, key)] = serialized
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._pending_lock:
+            self._pending[(namespace, key)] = None
+
+    def prune(self, namespace: str, max_age: float) -> int:
+        self.flush()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kv WHERE namespace = ? AND updated_at < ?", (namespace, time.time() - max_age)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def flush(self) -> None:
+        """Write all pending changes in a single transaction"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        now = time.time()
+        try:
+            with self._db_lock:
+                with self._conn:
+                    # Takes the write lock first, so no other process can hand out the same versions
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    base = self._conn.execute("SELECT version FROM kv_version").fetchone()[0]
+                    rows = [
+                        (namespace, key, value if value is not None else "null", now, base + i)
+                        for i, ((namespace, key), value) in enumerate(pending.items(), start=1)
+                    ]
+                    self._conn.execute("UPDATE kv_version SET version = ?", (base + len(rows),))
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO kv (namespace, key, value, updated_at, version) VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                self._own_versions.update(row[4] for row in rows)
+        except Exception as e:
+            logger.error(f"Error flushing storage: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+            # Put the batch back unless newer writes replaced it meanwhile
+            with self._pending_lock:
+                for item, value in pending.items():
+                    self._pending.setdefault(item, value)
+            raise
+
+        self.flushes += 1
+        self.rows_written += len(pending)
+
+    def watch(self, namespace: str, callback: ChangeCallback) -> None:
+        self._watchers.setdefault(namespace, []).append(callback)
+
+    def poll_changes(self) -> int:
+        """Hand rows other processes wrote since the last poll to the watchers, returning how many"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT namespace, key, value, version FROM kv WHERE version > ? ORDER BY version",
+                (self._seen_version,),
+            ).fetchall()
+            if not rows:
+                return 0
+            self._seen_version = rows[-1][3]
+            remote = [row for row in rows if row[3] not in self._own_versions]
+            self._own_versions = {version for version in self._own_versions if version > self._seen_version}
+
+        changes: Dict[str, Dict[str, Optional[dict]]] = {}
+        with self._pending_lock:
+            for namespace, key, value, _ in remote:
+                # A local write not flushed yet is newer than anything on disk
+                if namespace in self._watchers and (namespace, key) not in self._pending:
+                    changes.setdefault(namespace, {})[key] = json.loads(value)
+        for namespace, changed in changes.items():
+            for callback in self._watchers[namespace]:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    logger.error(f"Error applying storage changes to {namespace}: {type(e).__name__}")
+                    logger.debug(f"Full error details: {e}")
+        self.remote_changes += len(remote)
+        return len(remote)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # Logged by flush; the batch is retried on the next interval
+                pass
+            try:
+                self.poll_changes()
+            except Exception as e:
+                logger.error(f"Error reading storage changes: {type(e).__name__}")
+                logger.debug(f"Full error details: {e}")
+
+    def get_stats(self) -> dict:
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "pending_writes": pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "remote_changes": self.remote_changes,
+        }
+
+    def close(self) -> None:
+        self._stop.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_storage() -> Storage:
+    """Create the storage backend selected by POKE_STORAGE (sqlite or memory)"""
+    backend = os.getenv("POKE_STORAGE", "sqlite")
+    if backend == "memory":
+        return Storage()
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("POKE_DB_PATH", "poke.db"))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+class StoredDict(MutableMapping):
+    """Dict of pydantic models with a read-through cache over a storage namespace.
+
+    Assigning a value persists it. Models mutated in place must be assigned
+    back to be saved. Cached values are replaced when another process writes
+    the key (see SQLiteStorage); that arrives within a flush interval, so
+    call ``reload`` before a read-modify-write that must see the latest value.
+    """
+
+    def __init__(self, storage: Storage, namespace: str, model: Type[BaseModel]):
+        self.storage = storage
+        self.namespace = namespace
+        self.model = model
+        self._cache: Dict[str, BaseModel] = {}
+        storage.watch(namespace, self._on_change)
+
+    def _on_change(self, changes: Dict[str, Optional[dict]]) -> None:
+        for key, data in changes.items():
+            if key not in self._cache:
+                continue
+            if data is None:
+                self._cache.pop(key, None)
+                continue
+            try:
+                self._cache[key] = self.model.model_validate(data)
+            except ValueError:
+                self._cache.pop(key, None)
+
+    def reload(self, key: str) -> None:
+        """Replace the cached value with the stored one (blocking; run it off the event loop)"""
+        data = self.storage.load(self.namespace, key)
+        if data is not None:
+            self._cache[key] = self.model.model_validate(data)
+
+    def __getitem__(self, key: str) -> BaseModel:
+        if key in self._cache:
+            return self._cache[key]
+        data = self.storage.load(self.namespace, key)
+        if data is None:
+            raise KeyError(key)
+        value = self._cache[key] = self.model.model_validate(data)
+        return value
+
+    def __setitem__(self, key: str, value: BaseModel) -> None:
+        self._cache[key] = value
+        self.storage.save(self.namespace, key, value.model_dump(mode="json"))
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._cache.pop(key, None)
+        self.storage.delete(self.namespace, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(set(self._cache) | set(self.storage.keys(self.namespace)))
+
+    def __len__(self) -> int:
+        return len(set(self._cache) | set(self.storage.keys(self.namespace)))
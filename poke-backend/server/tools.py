@@ -1,14 +1,287 @@
-from .constants import composio
-from composio import Composio
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Tuple
 
-def get_stripe_tools(composio_client: Composio, user_id: str):
+from .executor import BlockingCallExecutor
+from .cassette import record_event
+from .metrics import ERRORS, TOOL_CALL_SECONDS, TOOL_RESULT_CACHE
+from .tracing import span
+
+if TYPE_CHECKING:
+    from composio import Composio
+    from langchain_core.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_TOOLS = [
+    "GMAIL_SEARCH_PEOPLE",
+    "GMAIL_GET_PROFILE",
+    "GMAIL_SEND_EMAIL",
+    "GMAIL_GET_EMAIL_THREAD",
+    "GMAIL_CREATE_EMAIL_DRAFT",
+    "COMPOSIO_SEARCH_SEARCH",
+    "COMPOSIO_SEARCH_EXA_SIMILARLINK",
+    "COMPOSIO_SEARCH_EXA_ANSWER",
+]
+
+def get_stripe_tools(composio_client: "Composio", user_id: str):
     return composio_client.tools.get(user_id,
         toolkits=[
             'STRIPE'
         ]
     )
     
-def get_google_tools(composio_client: Composio, user_id: str):
-    return composio_client.tools.get(user_id, tools=["GMAIL_SEARCH_PEOPLE", "GMAIL_GET_PROFILE", "GMAIL_SEND_EMAIL", "GMAIL_GET_EMAIL_THREAD"
-            "GMAIL_CREATE_EMAIL_DRAFT", "COMPOSIO_SEARCH_SEARCH", "COMPOSIO_SEARCH_EXA_SIMILARLINK", "COMPOSIO_SEARCH_EXA_ANSWER"])
+def get_google_tools(composio_client: "Composio", user_id: str):
+    return composio_client.tools.get(user_id, tools=GOOGLE_TOOLS)
+
+
+# Seconds a read-only tool's result is reused for the same user and arguments.
+# Tools not listed here (sending email, creating drafts) are never cached.
+TOOL_RESULT_TTLS = {
+    "GMAIL_GET_PROFILE": 3600,
+    "GMAIL_SEARCH_PEOPLE": 3600,
+    "GMAIL_GET_EMAIL_THREAD": 300,
+    "COMPOSIO_SEARCH_SEARCH": 900,
+    "COMPOSIO_SEARCH_EXA_SIMILARLINK": 900,
+    "COMPOSIO_SEARCH_EXA_ANSWER": 900,
+}
+
+# Side-effecting tools, never cached whatever POKE_TOOL_RESULT_TTLS says
+UNCACHEABLE_TOOLS = {"GMAIL_SEND_EMAIL", "GMAIL_CREATE_EMAIL_DRAFT"}
+
+
+def run_in_executor(
+    tool: "BaseTool",
+    executor: BlockingCallExecutor,
+    user_id: Optional[str] = None,
+    results: Optional["ToolResultCache"] = None,
+) -> "BaseTool":
+    """Wrap a synchronous tool so the graph executes it in ``executor``.
+
+    With ``results`` and ``user_id``, read-only calls are memoized per user.
+    """
+    from langchain_core.tools import StructuredTool
+
+    func = getattr(tool, "func", None) or (lambda **kwargs: tool.invoke(kwargs))
+
+    async def arun(**kwargs):
+        if results is None or user_id is None:
+            return await execute(**kwargs)
+        started = time.monotonic()
+        result, cached = await results.get(user_id, tool.name, kwargs, lambda: execute(**kwargs))
+        if cached:
+            with span("tool", tool.name) as attributes:
+                attributes["cached"] = True
+            # Recorded too, so a replay without the cache still finds the result
+            record_event("tool", started, name=tool.name, args=kwargs, result=result, cached=True)
+        return result
+
+    async def execute(**kwargs):
+        started = time.monotonic()
+        try:
+            with TOOL_CALL_SECONDS.time(tool=tool.name), span("tool", tool.name) as attributes:
+                attributes["args_bytes"] = len(json.dumps(kwargs, default=str))
+                result = await executor.run(func, **kwargs)
+                attributes["result_bytes"] = len(result if isinstance(result, str) else json.dumps(result, default=str))
+        except Exception as e:
+            ERRORS.inc(stage="tool", error_type=type(e).__name__)
+            record_event("tool", started, name=tool.name, args=kwargs, error=type(e).__name__)
+            raise
+        record_event("tool", started, name=tool.name, args=kwargs, result=result)
+        return result
+
+    return StructuredTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        coroutine=arun,
+    )
+
+
+class ToolDefinitionCache:
+    """Per-user cache of Composio tool definitions.
+
+    Entries younger than ``ttl`` are served directly. Entries past ``ttl`` but
+    within ``stale_ttl`` are still served while a single background refresh
+    fetches new definitions, so a slow Composio response never blocks a message.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, stale_ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("POKE_TOOL_CACHE_TTL", "3600"))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(os.getenv("POKE_TOOL_CACHE_STALE_TTL", "86400"))
+        self._entries: Dict[str, tuple] = {}  # user_id -> (fetched_at, tools)
+        self._refreshes: Dict[str, asyncio.Task] = {}
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    async def get(self, user_id: str, fetch: Callable[[], Awaitable[list]]) -> list:
+        """Get tools for a user, calling ``fetch`` on a miss or when the entry is stale"""
+        entry = self._entries.get(user_id)
+        if entry:
+            fetched_at, tools = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return tools
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh(user_id, fetch)
+                return tools
+
+        self.misses += 1
+        return await asyncio.shield(self._refresh(user_id, fetch))
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop cached tools for a user, e.g. when their connection status changes"""
+        self._entries.pop(user_id, None)
+        # Refreshes already in flight must not repopulate the entry
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def _refresh(self, user_id: str, fetch: Callable[[], Awaitable[list]]) -> asyncio.Task:
+        """Start a refresh for a user unless one is already running"""
+        task = self._refreshes.get(user_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._fetch(user_id, fetch))
+            # Background refresh failures are logged in _fetch; mark them retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._refreshes[user_id] = task
+        return task
+
+    async def _fetch(self, user_id: str, fetch: Callable[[], Awaitable[list]]) -> list:
+        generation = self._generations.get(user_id, 0)
+        try:
+            tools = await fetch()
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.error(f"Error fetching tools for user {user_id}: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+            raise
+        finally:
+            self._refreshes.pop(user_id, None)
+
+        if self._generations.get(user_id, 0) == generation:
+            self._entries[user_id] = (time.monotonic(), tools)
+        return tools
+
+    def get_stats(self) -> dict:
+        """Get cache size and hit counts"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+
+def _load_result_ttls() -> Dict[str, float]:
+    """Code defaults, overridden per tool by the POKE_TOOL_RESULT_TTLS JSON object"""
+    ttls = dict(TOOL_RESULT_TTLS)
+    overrides = os.getenv("POKE_TOOL_RESULT_TTLS")
+    if overrides:
+        try:
+            ttls.update(json.loads(overrides))
+        except Exception as e:
+            logger.error(f"Ignoring invalid POKE_TOOL_RESULT_TTLS: {type(e).__name__}")
+            logger.debug(f"Full error details: {e}")
+    return {name: float(ttl) for name, ttl in ttls.items() if name not in UNCACHEABLE_TOOLS and ttl}
+
+
+class ToolResultCache:
+    """Per-user memo of read-only tool results.
+
+    Research runs repeat the same profile, people and web searches within a
+    run and across runs. Results are keyed by user, tool and normalized
+    arguments; identical calls already in flight share one execution, and
+    failed calls are not kept.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, max_size: Optional[int] = None):
+        self.ttls = ttls if ttls is not None else _load_result_ttls()
+        self.max_size = max_size or int(os.getenv("POKE_TOOL_RESULT_CACHE_SIZE", "1024"))
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, result)
+        self._in_flight: Dict[tuple, asyncio.Task] = {}
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    @staticmethod
+    def _normalize(args: dict) -> str:
+        args = {key: value.strip() if isinstance(value, str) else value for key, value in args.items() if value is not None}
+        return json.dumps(args, sort_keys=True, default=str)
+
+    async def get(self, user_id: str, tool_name: str, args: dict, execute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """The tool's result and whether it came from the cache"""
+        ttl = self.ttls.get(tool_name)
+        if not ttl:
+            return await execute(), False
+
+        key = (user_id, tool_name, self._normalize(args))
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self._count(self.hits, tool_name, "hit")
+                return result, True
+            del self._entries[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._count(self.hits, tool_name, "hit")
+            return await asyncio.shield(task), True
+
+        self._count(self.misses, tool_name, "miss")
+        task = asyncio.ensure_future(execute())
+        self._in_flight[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self._in_flight.pop(key, None)
+        # Composio reports tool failures in the result rather than raising
+        if not (isinstance(result, dict) and result.get("successful") is False):
+            self._entries[key] = (time.monotonic() + ttl, result)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result, False
+
+    @staticmethod
+    def _count(counts: Dict[str, int], tool_name: str, result: str) -> None:
+        counts[tool_name] = counts.get(tool_name, 0) + 1
+        TOOL_RESULT_CACHE.inc(tool=tool_name, result=result)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's cached results, e.g. when their connection changes"""
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+    def get_stats(self) -> dict:
+        """Get cache size and per-tool hit rates"""
+        tools = {}
+        for name in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits.get(name, 0), self.misses.get(name, 0)
+            tools[name] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttls,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "tools": tools,
+        }
+
 
+tool_cache = ToolDefinitionCache()
+tool_results = ToolResultCache()
@@ -0,0 +1,116 @@
+import contextvars
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+
+# Trace of the message being processed; spans recorded anywhere in the run
+# (graph nodes, model calls, tools) attach to it
+current_trace: contextvars.ContextVar[Optional["MessageTrace"]] = contextvars.ContextVar("current_trace", default=None)
+
+
+class MessageTrace:
+    """Timeline of one message run: graph node steps, model calls and tool calls"""
+
+    def __init__(self, message_id: str, user_id: str, max_spans: int):
+        self.message_id = message_id
+        self.user_id = user_id
+        self.max_spans = max_spans
+        self.started_at = datetime.now().isoformat()
+        self.status = "processing"
+        self.attempts = 0
+        self.spans: List[dict] = []
+        self.dropped_spans = 0
+        self.queue_wait_ms: Optional[float] = None
+        self.duration_ms: Optional[float] = None
+        self.usage: Optional[dict] = None  # token usage of the latest attempt
+        self._started = time.monotonic()
+
+    def start_attempt(self, queue_wait: float) -> None:
+        self.attempts += 1
+        self.status = "processing"
+        self.queue_wait_ms = round(queue_wait * 1000, 1)
+        self._attempt_started = time.monotonic()
+
+    def add_span(self, kind: str, name: str, started: float, **attributes) -> None:
+        if len(self.spans) >= self.max_spans:
+            self.dropped_spans += 1
+            return
+        self.spans.append({
+            "kind": kind,
+            "name": name,
+            "attempt": self.attempts,
+            "start_ms": round((started - self._started) * 1000, 1),
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+            **attributes,
+        })
+
+    def finish(self, status: str) -> None:
+        self.status = status
+        self.duration_ms = round((time.monotonic() - self._attempt_started) * 1000, 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "message_id": self.message_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "started_at": self.started_at,
+            "attempts": self.attempts,
+            "queue_wait_ms": self.queue_wait_ms,
+            "duration_ms": self.duration_ms,
+            "usage": self.usage,
+            # Spans are recorded when they end; list them in start order
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+            "dropped_spans": self.dropped_spans,
+        }
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes):
+    """Record the ``with`` block as a span of the current trace, if there is one.
+
+    Yields a dict the block can add attributes to, e.g. result sizes.
+    """
+    trace = current_trace.get()
+    started = time.monotonic()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        if trace is not None:
+            trace.add_span(kind, name, started, **attributes)
+
+
+class TraceStore:
+    """Bounded LRU of message traces, most recently started kept"""
+
+    def __init__(self, max_size: Optional[int] = None, max_spans: Optional[int] = None):
+        self.max_size = max_size or int(os.getenv("POKE_TRACE_STORE_MAX_SIZE", "1000"))
+        self.max_spans = max_spans or int(os.getenv("POKE_TRACE_MAX_SPANS", "500"))
+        self._traces: OrderedDict = OrderedDict()
+        self.evicted = 0
+
+    def start(self, message_id: str, user_id: str, queue_wait: float) -> MessageTrace:
+        """Start (or, for a retried message, continue) the trace of a message run"""
+        trace = self._traces.pop(message_id, None) or MessageTrace(message_id, user_id, self.max_spans)
+        trace.start_attempt(queue_wait)
+        self._traces[message_id] = trace
+        while len(self._traces) > self.max_size:
+            self._traces.popitem(last=False)
+            self.evicted += 1
+        return trace
+
+    def get(self, message_id: str) -> Optional[dict]:
+        trace = self._traces.get(message_id)
+        return trace.to_dict() if trace else None
+
+    def get_stats(self) -> dict:
+        return {
+            "size": len(self._traces),
+            "max_size": self.max_size,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,59 @@
+import contextvars
+import threading
+from typing import Optional
+
+from .metrics import LLM_TOKENS
+
+# Token usage of the agent run in progress
+run_usage: contextvars.ContextVar[Optional["TokenUsage"]] = contextvars.ContextVar("run_usage", default=None)
+
+
+class TokenUsage:
+    """Prompt, completion and cached prompt tokens summed over model calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage_metadata: dict) -> None:
+        details = usage_metadata.get("input_token_details") or {}
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += usage_metadata.get("input_tokens", 0)
+            self.completion_tokens += usage_metadata.get("output_tokens", 0)
+            self.cached_tokens += details.get("cache_read", 0) or 0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """Share of prompt tokens served from the provider's prompt cache"""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "model_calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit_ratio": round(self.cache_hit_ratio, 4),
+        }
+
+
+# Usage across all runs since startup
+total_usage = TokenUsage()
+
+
+def record_usage(usage_metadata: Optional[dict]) -> None:
+    """Count one model call's usage towards the current run and the process totals"""
+    if not usage_metadata:
+        return
+    usage = run_usage.get()
+    if usage is not None:
+        usage.add(usage_metadata)
+    total_usage.add(usage_metadata)
+    details = usage_metadata.get("input_token_details") or {}
+    LLM_TOKENS.inc(usage_metadata.get("input_tokens", 0), kind="prompt")
+    LLM_TOKENS.inc(usage_metadata.get("output_tokens", 0), kind="completion")
+    LLM_TOKENS.inc(details.get("cache_read", 0) or 0, kind="cached")
@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def test_env_file_configures_import_time_singletons(tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text("POKE_OPENAI_RPM=7\nPOKE_COMPOSIO_MAX_WORKERS=3\nPOKE_TOOL_CACHE_TTL=5\n")
+    # Point the server's load_dotenv() at our file, then import it the way main.py does
+    script = f"""
+import dotenv
+load_dotenv = dotenv.load_dotenv
+dotenv.load_dotenv = lambda *args, **kwargs: load_dotenv({str(env_file)!r})
+import server.api
+from server.executor import composio_executor
+from server.rate_limit import openai_limiter
+from server.tools import tool_cache
+print(round(openai_limiter.requests.rate * 60), composio_executor.max_workers, round(tool_cache.ttl))
+"""
+    env = {key: value for key, value in os.environ.items() if not key.startswith("POKE_")}
+    env.update(POKE_STORAGE="memory", POKE_QUEUE_BACKEND="memory")
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.split()[-3:] == ["7", "3", "5"]
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from server.message_queue import MessageQueue, QueueFullError, SQLiteMessageQueue
+from server.models import Message
+
+
+def make_message(message_id: str, user_id: str = "u1") -> Message:
+    return Message(user_id=user_id, content="hi", message_type="user", message_id=message_id)
+
+
+def test_dead_letters_are_capped(tmp_path, monkeypatch):
+    monkeypatch.setenv("POKE_QUEUE_MAX_DEAD_LETTERS", "2")
+    queue = SQLiteMessageQueue(str(tmp_path / "poke.db"), max_attempts=1, max_per_user=10)
+
+    async def run():
+        for i in range(4):
+            await queue.aput(make_message(f"m{i}"))
+            message, _ = await queue.get()
+            assert not await queue.anack(message.message_id, "boom")
+        queue._pruned_at = 0.0
+        await queue.aput(make_message("last"))
+        await queue.get()
+        return await queue.adead_letters(), await queue.aget_stats()
+
+    dead_letters, stats = asyncio.run(run())
+    assert [entry["message_id"] for entry in dead_letters] == ["m3", "m2"]
+    assert stats["dead_letters"] == 2
+
+
+def test_depth_is_counted_without_blocking(tmp_path):
+    queue = SQLiteMessageQueue(str(tmp_path / "poke.db"), max_per_user=10)
+
+    async def run():
+        for i in range(3):
+            await queue.aput(make_message(f"m{i}", user_id=f"u{i}"))
+        await queue.get()
+        return queue.depth, await queue.asize()
+
+    assert asyncio.run(run()) == (2, 2)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_queue(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MessageQueue(**kwargs)
+        return SQLiteMessageQueue(str(tmp_path / "poke.db"), **kwargs)
+    return make
+
+
+def test_capacity_counts_in_flight_messages(make_queue):
+    queue = make_queue(maxsize=2, max_per_user=10)
+
+    async def run():
+        await queue.aput(make_message("m1", user_id="u1"))
+        await queue.aput(make_message("m2", user_id="u2"))
+        await queue.get()
+        # One queued and one in flight: full
+        with pytest.raises(QueueFullError) as full:
+            await queue.aput(make_message("m3", user_id="u3"))
+        assert full.value.scope == "global"
+        await queue.aack("m1")
+        await queue.aput(make_message("m3", user_id="u3"))
+
+    asyncio.run(run())
+
+
+def test_user_limit_counts_in_flight_messages(make_queue):
+    queue = make_queue(maxsize=10, max_per_user=2)
+
+    async def run():
+        await queue.aput(make_message("m1"))
+        await queue.aput(make_message("m2"))
+        await queue.get()
+        with pytest.raises(QueueFullError) as full:
+            await queue.aput(make_message("m3"))
+        assert full.value.scope == "user"
+        await queue.aack("m1")
+        await queue.aput(make_message("m3"))
+
+    asyncio.run(run())
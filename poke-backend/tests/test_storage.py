@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from server.models import User
+from server.response_store import ResponseStore
+from server.storage import SQLiteStorage, StoredDict
+
+
+def open_process(path):
+    """Storage, users and responses as one server process would hold them"""
+    storage = SQLiteStorage(str(path), flush_interval=3600)
+    return storage, StoredDict(storage, "users", User), ResponseStore(storage=storage)
+
+
+def test_stored_dict_follows_writes_from_another_process(tmp_path):
+    storage_a, users_a, _ = open_process(tmp_path / "poke.db")
+    storage_b, users_b, _ = open_process(tmp_path / "poke.db")
+
+    users_a["c1"] = User(connection_id="c1", name="before")
+    storage_a.flush()
+    assert users_b["c1"].name == "before"
+
+    users_a["c1"] = User(connection_id="c1", name="after")
+    storage_a.flush()
+    assert users_b["c1"].name == "before"  # cached until the change is polled
+    assert storage_b.poll_changes() == 1
+    assert users_b["c1"].name == "after"
+    # A process is not told about its own writes
+    assert storage_a.poll_changes() == 0
+
+    del users_a["c1"]
+    storage_a.flush()
+    storage_b.poll_changes()
+    assert "c1" not in users_b
+    assert list(users_b) == []
+
+
+def test_reload_reads_the_latest_stored_value(tmp_path):
+    storage_a, users_a, _ = open_process(tmp_path / "poke.db")
+    storage_b, users_b, _ = open_process(tmp_path / "poke.db")
+    users_a["c1"] = User(connection_id="c1", name="before")
+    storage_a.flush()
+    users_b["c1"]
+    users_a["c1"] = User(connection_id="c1", name="after")
+    storage_a.flush()
+
+    users_b.reload("c1")
+    assert users_b["c1"].name == "after"
+
+
+def test_response_answered_by_another_process(tmp_path):
+    storage_a, _, responses_a = open_process(tmp_path / "poke.db")
+    storage_b, _, responses_b = open_process(tmp_path / "poke.db")
+    responses_b["m1"] = {"response": None, "timestamp": datetime.now().isoformat(), "status": "processing"}
+    storage_b.flush()
+
+    responses_a["m1"] = {"response": "hi", "timestamp": datetime.now().isoformat(), "status": "completed"}
+    storage_a.flush()
+    assert responses_b.get("m1")["status"] == "processing"
+    storage_b.poll_changes()
+    assert responses_b.get("m1") == responses_a.get("m1")
+    assert responses_b.get_stats()["remote_updates"] == 1
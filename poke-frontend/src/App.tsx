@@ -5,7 +5,7 @@ import { ChatBubble } from './components/ChatBubble';
 import { TypingIndicator } from './components/TypingIndicator';
 import { MessageInput } from './components/MessageInput';
 import { apiClient } from './api';
-import type { Message } from './types';
+import type { Message, StreamEvent } from './types';
 
 function App() {
   const [userId, setUserId] = useState<string | null>(null);
@@ -249,6 +249,55 @@ function App() {
     poll();
   };
 
+  const streamMessageResponse = (messageId: string) => {
+    const agentMessageId = `msg_${Date.now()}_agent`;
+    let draft = '';
+    let finished = false;
+
+    const upsertAgentMessage = (content: string) => {
+      const agentMessage: Message = {
+        id: agentMessageId,
+        content,
+        sender: 'agent',
+        timestamp: new Date(),
+      };
+      setMessages(prev =>
+        prev.some(msg => msg.id === agentMessageId)
+          ? prev.map(msg => (msg.id === agentMessageId ? agentMessage : msg))
+          : [...prev, agentMessage]
+      );
+    };
+
+    const handleEvent = (event: StreamEvent) => {
+      if (event.type === 'model_start') {
+        // Each agent step starts a fresh draft
+        draft = '';
+      } else if (event.type === 'token' && event.content) {
+        draft += event.content;
+        upsertAgentMessage(draft);
+        setIsTyping(false);
+      } else if (event.type === 'completed') {
+        finished = true;
+        upsertAgentMessage(event.response ?? draft);
+        setIsTyping(false);
+      } else if (event.type === 'error') {
+        finished = true;
+        upsertAgentMessage("Sorry, I encountered an error processing your message.");
+        setIsTyping(false);
+      }
+    };
+
+    const handleError = () => {
+      if (finished) return;
+      // Streaming unavailable; drop any partial draft and fall back to polling
+      setMessages(prev => prev.filter(msg => msg.id !== agentMessageId));
+      setIsTyping(true);
+      pollForMessageResponse(messageId);
+    };
+
+    apiClient.streamMessageResponse(messageId, handleEvent, handleError);
+  };
+
   const handleSendMessage = async (content: string) => {
     if (!userId) return;
 
@@ -277,11 +326,11 @@ function App() {
         )
       );
 
-      // Show typing indicator and poll for specific message response
+      // Show typing indicator and stream the specific message response
       setIsTyping(true);
       
-      // Poll for the specific message response
-      pollForMessageResponse(result.message_id);
+      // Stream the response as it is generated, polling only as a fallback
+      streamMessageResponse(result.message_id);
 
     } catch (error) {
       console.error('Failed to send message:', error);
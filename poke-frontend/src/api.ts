@@ -1,3 +1,5 @@
+import type { StreamEvent } from './types';
+
 const API_BASE_URL = 'http://localhost:8000';
 
 export class ApiClient {
@@ -55,8 +57,10 @@ export class ApiClient {
     return response.json();
   }
 
-  async checkConnectionStatus(connectionId: string): Promise<any> {
-    const response = await fetch(`${this.baseUrl}/connections/${connectionId}/status`);
+  async checkConnectionStatus(connectionId: string, wait: boolean = false): Promise<any> {
+    // In wait mode the server holds the request open until the connection settles
+    const query = wait ? '?wait=true&timeout=30' : '';
+    const response = await fetch(`${this.baseUrl}/connections/${connectionId}/status${query}`);
     
     if (!response.ok) {
       throw new Error(`Failed to check connection status: ${response.statusText}`);
@@ -94,6 +98,29 @@ export class ApiClient {
     return response.json();
   }
 
+  streamMessageResponse(
+    messageId: string,
+    onEvent: (event: StreamEvent) => void,
+    onError: () => void,
+  ): EventSource {
+    const source = new EventSource(`${this.baseUrl}/messages/${messageId}/stream`);
+
+    source.onmessage = (e) => {
+      const event: StreamEvent = JSON.parse(e.data);
+      if (event.type === 'completed' || event.type === 'error') {
+        source.close();
+      }
+      onEvent(event);
+    };
+
+    source.onerror = () => {
+      source.close();
+      onError();
+    };
+
+    return source;
+  }
+
   async getUserMemory(userId: string): Promise<any> {
     const response = await fetch(`${this.baseUrl}/users/${userId}/memory`);
     
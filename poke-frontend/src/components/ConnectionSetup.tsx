@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { Mail, User, Loader2, ExternalLink } from 'lucide-react';
 import { apiClient } from '../api';
 
@@ -72,6 +72,37 @@ export function ConnectionSetup({ onConnectionEstablished }: ConnectionSetupProp
     }
   };
 
+  // Long-poll for activation so the user doesn't have to confirm manually
+  useEffect(() => {
+    if (step !== 'auth' || !connectionData?.connectionId) return;
+
+    let cancelled = false;
+    const waitForActivation = async () => {
+      while (!cancelled) {
+        try {
+          const status = await apiClient.checkConnectionStatus(connectionData.connectionId!, true);
+          if (cancelled) return;
+          if (status.status === 'ACTIVE' || status.status === 'connected') {
+            handleAuthComplete();
+            return;
+          }
+          if (status.status === 'FAILED' || status.status === 'EXPIRED') {
+            setError('Gmail authorization failed, please try again');
+            return;
+          }
+        } catch (err) {
+          // Back off briefly before waiting again
+          await new Promise(resolve => setTimeout(resolve, 5000));
+        }
+      }
+    };
+
+    waitForActivation();
+    return () => {
+      cancelled = true;
+    };
+  }, [step, connectionData?.connectionId]);
+
   if (step === 'user-info') {
     return (
       <div className="flex flex-col items-center justify-center min-h-screen bg-gray-50 p-4">
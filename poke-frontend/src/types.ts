@@ -18,4 +18,11 @@ export interface ConnectionStatus {
   status: string;
   connection_id: string;
   redirect_url?: string;
+}
+
+export interface StreamEvent {
+  type: 'started' | 'model_start' | 'token' | 'tool_start' | 'tool_end' | 'completed' | 'error';
+  content?: string;
+  tool?: string;
+  response?: string;
 }
\ No newline at end of file